@@ -370,6 +370,13 @@ def kill(waiter_url=None, token_name_or_service_id=None, flags=None, kill_flags=
     return cp
 
 
+def logs(waiter_url=None, service_id=None, flags=None, logs_flags=None):
+    """Prints the logs of the instances of a service via the CLI"""
+    args = f'logs {service_id} {logs_flags or ""}'
+    cp = cli(args, waiter_url, flags)
+    return cp
+
+
 def init(waiter_url=None, flags=None, init_flags=None):
     """Creates a barebones token JSON file via the CLI"""
     args = f'init {init_flags or ""}'
@@ -426,3 +433,46 @@ def stop(token_name, waiter_url=None, flags=None, maintenance_flags=None, stdin=
     args = f"stop {token_name} {maintenance_flags or ''}"
     cp = cli(args, waiter_url, flags, stdin, env=env)
     return cp
+
+
+def apply(waiter_url=None, files=None, flags=None, apply_flags=None):
+    """Reconciles tokens with the definitions in the given files via the CLI"""
+    args = f"apply {' '.join(files or [])} {apply_flags or ''}"
+    cp = cli(args, waiter_url, flags)
+    return cp
+
+
+def completion(args, waiter_url=None, flags=None, env=None):
+    """Runs a completion sub-command via the CLI"""
+    cp = cli(f'completion {args}', waiter_url, flags, env=env)
+    return cp
+
+
+def batch(waiter_url=None, commands=None, flags=None, batch_flags=None):
+    """Runs the given command lines in a batch via the CLI, returning the parsed results of the commands"""
+    cp = cli(f"batch {batch_flags or ''}", waiter_url, flags, stdin='\n'.join(commands or []).encode())
+    results = [json.loads(line) for line in stdout(cp).splitlines()]
+    return cp, results
+
+
+def agent(args, env=None):
+    """Runs an agent sub-command via the CLI"""
+    cp = cli(f'agent {args}', env=env)
+    return cp
+
+
+def import_times(args, flags=None):
+    """
+    Runs a CLI command with Python's import time profiling (the equivalent of -X importtime) enabled,
+    and returns the CompletedProcess along with the cumulative import time in microseconds of each module
+    """
+    env = os.environ.copy()
+    env['PYTHONPROFILEIMPORTTIME'] = '1'
+    cp = cli(args, flags=flags, env=env)
+    times = {}
+    for line in decode(cp.stderr).splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative_us, module = [part.strip() for part in line[len('import time:'):].split('|')]
+            if cumulative_us.isdigit():
+                times[module] = int(cumulative_us)
+    return cp, times
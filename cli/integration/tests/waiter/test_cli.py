@@ -4,6 +4,7 @@ import json
 import logging
 import os
 import re
+import socket
 import tempfile
 import threading
 import unittest
@@ -405,6 +406,175 @@ class WaiterCliTest(util.WaiterTest):
             finally:
                 util.delete_token(self.waiter_url, token_name)
 
+    def test_config_file_changes_are_picked_up(self):
+        cluster_name_1 = str(uuid.uuid4())
+        config = {'clusters': [{'name': cluster_name_1, 'url': self.waiter_url}]}
+        with cli.temp_config_file(config) as path:
+            flags = f'--config {path} --cluster {cluster_name_1}'
+            cp = cli.tokens(flags=flags)
+            self.assertIn(cp.returncode, [0, 1], cp.stderr)
+            self.assertNotIn('was not present in your config', cli.stderr(cp))
+
+            # The compiled configuration cached by the previous run must not be reused
+            cluster_name_2 = f'{uuid.uuid4()}-renamed'
+            cli.write_json(path, {'clusters': [{'name': cluster_name_2, 'url': self.waiter_url}]})
+            cp = cli.tokens(flags=flags)
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn(f'You specified cluster {cluster_name_1}, which was not present in your config',
+                          cli.stderr(cp))
+
+    def test_completion(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                env = os.environ.copy()
+                env['XDG_CACHE_HOME'] = cache_dir
+                # the index is not maintained until completion is enabled
+                cp = cli.cli(f'show {token_name}', self.waiter_url, env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual([], [f for f in os.listdir(os.path.join(cache_dir, 'waiter'))
+                                      if f.startswith('completion-')])
+
+                cp = cli.completion('bash', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn('complete -o default -F _waiter waiter', cli.stdout(cp))
+                self.assertTrue(os.path.isfile(os.path.join(cache_dir, 'waiter', 'completion-enabled')))
+
+                cp = cli.completion('refresh', self.waiter_url, env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                cp = cli.completion(f'names {token_name[:-1]}', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn(token_name, cli.stdout(cp).split('\n'))
+                cp = cli.completion(f'names {token_name}-missing', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual('', cli.stdout(cp))
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
+    def test_batch(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        try:
+            commands = [f'--url {self.waiter_url} show {token_name} --json',
+                        json.dumps({'id': 'missing', 'args': ['--url', self.waiter_url, 'show', f'{token_name}-missing']}),
+                        f'waiter --url {self.waiter_url} show {token_name} --yaml']
+            cp, results = cli.batch(commands=commands)
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertEqual([0, 1, 2], [r['index'] for r in results])
+            self.assertEqual([0, 1, 0], [r['exit-code'] for r in results])
+            self.assertEqual('missing', results[1]['id'])
+            self.assertIn('No matching data found', results[1]['stdout'])
+            cluster_data = list(json.loads(results[0]['stdout'])['clusters'].values())
+            token_data = cluster_data[0]['token']
+            self.assertEqual(0.1, token_data['cpus'])
+            self.assertIn('cpus: 0.1', results[2]['stdout'])
+
+            cp, results = cli.batch(commands=commands[1:], batch_flags='--fail-fast')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertEqual(['missing'], [r.get('id') for r in results])
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
+    def test_agent(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = os.environ.copy()
+            env['XDG_CACHE_HOME'] = cache_dir
+            env['WAITER_AGENT'] = 'true'
+            try:
+                local_cp = cli.cli(f'show {token_name} --json', self.waiter_url)
+                self.assertEqual(0, local_cp.returncode, local_cp.stderr)
+
+                # The agent is started on demand by the first forwarded command
+                for _ in range(2):
+                    cp = cli.cli(f'show {token_name} --json', self.waiter_url, env=env)
+                    self.assertEqual(0, cp.returncode, cp.stderr)
+                    self.assertEqual(json.loads(cli.stdout(local_cp)), json.loads(cli.stdout(cp)))
+                cp = cli.agent('status', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+
+                cp = cli.cli(f'show {token_name}-missing', self.waiter_url, env=env)
+                self.assertEqual(1, cp.returncode, cp.stderr)
+                self.assertIn('No matching data found', cli.stdout(cp))
+            finally:
+                cp = cli.agent('stop', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                util.delete_token(self.waiter_url, token_name)
+            cp = cli.agent('status', env=env)
+            self.assertEqual(1, cp.returncode, cp.stderr)
+
+    def test_metrics_udp(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink:
+            sink.bind(('127.0.0.1', 0))
+            sink.settimeout(5)
+            config = {'clusters': [{'name': 'foo', 'url': self.waiter_url}],
+                      'metrics': {'disabled': False,
+                                  'host': '127.0.0.1',
+                                  'port': sink.getsockname()[1],
+                                  'protocol': 'udp',
+                                  'line-formats': {'count': '{namespace}.{name}:{value}|c',
+                                                   'histogram': '{namespace}.{name}:{value}|h',
+                                                   'timer': '{namespace}.{name}:{value}|ms'}}}
+            with cli.temp_config_file(config) as path:
+                cp = cli.tokens(flags=f'--config {path}')
+                self.assertIn(cp.returncode, [0, 1], cp.stderr)
+                lines = []
+                while not any(line.startswith('waitercli.command.tokens.latency:') for line in lines):
+                    lines.extend(sink.recv(65535).decode().split('\n'))
+                self.assertIn('waitercli.command.tokens.runs:1|c', lines)
+                self.assertIn('waitercli.query.fan-out:1|h', lines)
+                self.assertIn('waitercli.cluster.foo.request.status.200:1|c', lines)
+                self.assertTrue(any(re.match(r'waitercli\.cluster\.foo\.request\.latency:[0-9.]+\|ms', line)
+                                    for line in lines), lines)
+
+    def test_metrics_sink_unavailable(self):
+        # a sink that does not accept connections must neither fail nor noticeably delay the command
+        config = {'clusters': [{'name': 'foo', 'url': self.waiter_url}],
+                  'metrics': {'disabled': False,
+                              'host': '10.255.255.1',
+                              'port': 8125,
+                              'timeout': 5,
+                              'line-formats': {'count': '{namespace}.{name}:{value}|c'}}}
+        with cli.temp_config_file(config) as path:
+            start_time = datetime.datetime.now()
+            cp = cli.tokens(flags=f'--config {path}')
+            self.assertIn(cp.returncode, [0, 1], cp.stderr)
+            self.assertLess((datetime.datetime.now() - start_time).total_seconds(), 5)
+
+    def test_metrics_spool(self):
+        with socket.socket() as sink, tempfile.TemporaryDirectory() as cache_dir:
+            sink.bind(('127.0.0.1', 0))
+            sink.settimeout(5)
+            env = os.environ.copy()
+            env['XDG_CACHE_HOME'] = cache_dir
+            # no background index refresh, whose process would send (or drain) metrics too
+            config = {'clusters': [{'name': 'foo', 'url': self.waiter_url}],
+                      'completion': {'refresh-interval-secs': 0},
+                      'metrics': {'disabled': False,
+                                  'host': '127.0.0.1',
+                                  'port': sink.getsockname()[1],
+                                  'line-formats': {'count': '{namespace}.{name}:{value}|c'}}}
+            with cli.temp_config_file(config) as path:
+                # the sink does not accept connections yet, so the metrics are spooled
+                cp = cli.cli('tokens', flags=f'--config {path}', env=env)
+                self.assertIn(cp.returncode, [0, 1], cp.stderr)
+                spool_path = os.path.join(cache_dir, 'waiter', 'metrics-spool.txt')
+                with open(spool_path) as spool_file:
+                    self.assertIn('waitercli.command.tokens.runs:1|c', spool_file.read().splitlines())
+
+                # once the sink is available, the spooled metrics are sent along with the new ones
+                sink.listen()
+                cp = cli.cli('show foo', flags=f'--config {path}', env=env)
+                self.assertIn(cp.returncode, [0, 1], cp.stderr)
+                conn, _ = sink.accept()
+                with conn:
+                    conn.settimeout(5)
+                    lines = conn.makefile().read().splitlines()
+                self.assertIn('waitercli.command.show.runs:1|c', lines)
+                self.assertIn('waitercli.command.tokens.runs:1|c', lines)
+
     def test_avoid_exit_on_connection_error(self):
         token_name = self.token_name()
         util.post_token(self.waiter_url, token_name, {'cpus': 0.1})
@@ -899,6 +1069,56 @@ class WaiterCliTest(util.WaiterTest):
     def test_update_token_yaml(self):
         self.__test_update_token('yaml')
 
+    def __test_apply_tokens(self, file_format):
+        token_name_1 = self.token_name()
+        token_name_2 = self.token_name()
+        util.post_token(self.waiter_url, token_name_2, {'cpus': 0.1, 'mem': 128, 'cmd': 'foo'})
+        try:
+            token_1 = {'token': token_name_1, 'cpus': 0.1, 'mem': 128, 'cmd': 'foo'}
+            token_2 = {'token': token_name_2, 'cpus': 0.2, 'mem': 128, 'cmd': 'foo'}
+            with cli.temp_token_file(token_1, file_format) as path_1, \
+                    cli.temp_token_file(token_2, file_format) as path_2:
+                cp = cli.apply(self.waiter_url, [path_1, path_2], apply_flags='--dry-run')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn('1 to create, 1 to update, 0 unchanged', cli.stdout(cp))
+                util.load_token(self.waiter_url, token_name_1, expected_status_code=404)
+
+                cp = cli.apply(self.waiter_url, [path_1, path_2])
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertEqual(0.1, util.load_token(self.waiter_url, token_name_1)['cpus'])
+                self.assertEqual(0.2, util.load_token(self.waiter_url, token_name_2)['cpus'])
+
+                cp = cli.apply(self.waiter_url, [path_1, path_2])
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn('0 to create, 0 to update, 2 unchanged', cli.stdout(cp))
+        finally:
+            util.delete_token(self.waiter_url, token_name_1, assert_response=False)
+            util.delete_token(self.waiter_url, token_name_2)
+
+    def test_apply_tokens_json(self):
+        self.__test_apply_tokens('json')
+
+    def test_apply_tokens_yaml(self):
+        self.__test_apply_tokens('yaml')
+
+    def test_apply_tokens_context_matrix(self):
+        token_name_prefix = self.token_name()
+        token_names = [f'{token_name_prefix}-{r}-{s}' for r in ('east', 'west') for s in (1, 2)]
+        token_fields = {'token': f'{token_name_prefix}-${{region}}-${{shard}}', 'cmd': 'foo ${shard}',
+                        'cpus': 0.1, 'mem': 128, 'metadata': {'region': '${region}'}}
+        try:
+            with cli.temp_token_file(token_fields, 'yaml') as token_path, \
+                    cli.temp_token_file({'region': ['east', 'west'], 'shard': [1, 2]}, 'yaml') as matrix_path:
+                cp = cli.apply(self.waiter_url, [token_path], apply_flags=f'--context-matrix {matrix_path}')
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIn('4 to create, 0 to update, 0 unchanged', cli.stdout(cp))
+                token_data = util.load_token(self.waiter_url, token_names[3])
+                self.assertEqual('foo 2', token_data['cmd'])
+                self.assertEqual({'region': 'west'}, token_data['metadata'])
+        finally:
+            for token_name in token_names:
+                util.delete_token(self.waiter_url, token_name, assert_response=False)
+
     def __test_post_token_and_flags(self, file_format):
         token_name = self.token_name()
         update_fields = {'cpus': 0.2, 'mem': 256}
@@ -1214,6 +1434,41 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name_1)
 
+    def test_startup_imports(self):
+        heavy_modules = ['arrow', 'humanfriendly', 'tabulate', 'yaml']
+        cp, import_times = cli.import_times('--version')
+        self.assertEqual(0, cp.returncode, cp.stderr)
+        self.logger.info(f'waiter --version spent {import_times["waiter.cli"]}us importing waiter.cli')
+        for module in ['requests', 'waiter.querying', *heavy_modules]:
+            self.assertNotIn(module, import_times)
+
+        # only the modules used by the tokens sub-command are imported
+        cp, import_times = cli.import_times('tokens --help')
+        self.assertEqual(0, cp.returncode, cp.stderr)
+        self.logger.info(f'waiter tokens --help spent {import_times["waiter.cli"]}us importing waiter.cli')
+        self.assertIn('waiter.querying', import_times)
+        for module in ['waiter.action', 'waiter.token_post', *heavy_modules]:
+            self.assertNotIn(module, import_times)
+
+    def test_tokens_ndjson(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, util.minimal_service_description())
+        try:
+            cp = cli.tokens(self.waiter_url, tokens_flags='--ndjson')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            records = [json.loads(line) for line in cli.stdout(cp).splitlines()]
+            token_data = next(r for r in records if r['token'] == token_name)
+            self.assertIn('cluster', token_data)
+            self.assertFalse(token_data['deleted'])
+
+            cp = cli.show(self.waiter_url, token_name, show_flags='--ndjson --no-services')
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            records = [json.loads(line) for line in cli.stdout(cp).splitlines()]
+            self.assertEqual(1, len(records))
+            self.assertEqual(util.load_token(self.waiter_url, token_name), records[0]['token'])
+        finally:
+            util.delete_token(self.waiter_url, token_name)
+
     def __test_create_token_containing_token_name(self, file_format):
         token_name = self.token_name()
         with cli.temp_token_file({'token': token_name, 'cpus': 0.1, 'mem': 128}, file_format) as path:
@@ -2162,6 +2417,32 @@ class WaiterCliTest(util.WaiterTest):
         finally:
             util.delete_token(self.waiter_url, token_name, kill_services=True)
 
+    def test_logs(self):
+        token_name = self.token_name()
+        token_fields = util.minimal_service_description()
+        token_fields['cmd'] = f'echo logs-test-{token_name} && {token_fields["cmd"]}'
+        util.post_token(self.waiter_url, token_name, token_fields)
+        try:
+            service_id = util.ping_token(self.waiter_url, token_name)
+            util.wait_until_routers_service(self.waiter_url, service_id,
+                                            lambda service: len(service['instances']['active-instances']) == 1)
+            instance = util.instances_for_service(self.waiter_url, service_id)['active-instances'][0]
+            cp = cli.logs(self.waiter_url, service_id, logs_flags='--file stdout')
+            stdout = cli.stdout(cp)
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            self.assertIn(f'{instance["id"]} stdout | logs-test-{token_name}', stdout)
+
+            cp = cli.logs(self.waiter_url, service_id, logs_flags='--file nonexistent')
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn(f'There are no matching log files for service id {service_id}.', cli.stdout(cp))
+        finally:
+            util.delete_token(self.waiter_url, token_name, kill_services=True)
+
+    def test_logs_non_existent_service(self):
+        cp = cli.logs(self.waiter_url, uuid.uuid4())
+        self.assertEqual(1, cp.returncode, cp.stderr)
+        self.assertIn('No matching data found', cli.stdout(cp))
+
     def test_ssh_instance_id(self):
         self.__test_ssh(lambda _, instances: instances['active-instances'], test_instance=True)
 
@@ -2187,6 +2468,58 @@ class WaiterCliTest(util.WaiterTest):
         self.assertEqual(1, cp.returncode, cp.stderr)
         self.assertIn('No matching data found', cli.stdout(cp))
 
+    def test_ssh_instance_id_cached(self):
+        token_name = self.token_name()
+        util.post_token(self.waiter_url, token_name, util.minimal_service_description())
+        try:
+            service_id = util.ping_token(self.waiter_url, token_name)
+            util.wait_until_routers_service(self.waiter_url, service_id,
+                                            lambda service: len(service['instances']['active-instances']) == 1)
+            instances = util.instances_for_service(self.waiter_url, service_id)['active-instances']
+            with tempfile.TemporaryDirectory() as cache_dir:
+                env = os.environ.copy()
+                env['WAITER_SSH'] = 'echo'
+                env['WAITER_KUBECTL'] = 'echo'
+                env['XDG_CACHE_HOME'] = cache_dir
+                cp = cli.ssh(self.waiter_url, instances[0]['id'], ssh_flags='-i', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                with open(os.path.join(cache_dir, 'waiter', 'instance-cache.json')) as cache_file:
+                    self.assertIn(instances[0]['id'], json.load(cache_file))
+
+                # the instance is resolved from the cache, even though its service is gone
+                util.kill_service(self.waiter_url, service_id)
+                cp = cli.ssh(self.waiter_url, instances[0]['id'], ssh_flags='-i', env=env)
+                self.assertEqual(0, cp.returncode, cp.stderr)
+                self.assertIsNotNone(util.get_ssh_instance_from_output(self.waiter_url, instances, cli.stdout(cp)))
+        finally:
+            util.delete_token(self.waiter_url, token_name, kill_services=True)
+
+    def test_ssh_all_instances(self):
+        token_name = self.token_name()
+        token_fields = util.minimal_service_description()
+        token_fields['min-instances'] = 2
+        util.post_token(self.waiter_url, token_name, token_fields)
+        try:
+            service_id = util.ping_token(self.waiter_url, token_name)
+            util.wait_until_routers_service(self.waiter_url, service_id,
+                                            lambda service: len(service['instances']['active-instances']) == 2)
+            instances = util.instances_for_service(self.waiter_url, service_id)['active-instances']
+            env = os.environ.copy()
+            env['WAITER_SSH'] = 'echo'
+            env['WAITER_KUBECTL'] = 'echo'
+            cp = cli.ssh(self.waiter_url, service_id, ssh_command='ls -al', ssh_flags='-s --all-instances', env=env)
+            stdout = cli.stdout(cp)
+            self.assertEqual(0, cp.returncode, cp.stderr)
+            for instance in instances:
+                self.assertIn(f'{instance["id"]} | ', stdout)
+            self.assertIn('2 instance(s) succeeded', stdout)
+
+            cp = cli.ssh(self.waiter_url, service_id, ssh_flags='-s --all-instances', env=env)
+            self.assertEqual(1, cp.returncode, cp.stderr)
+            self.assertIn('You must provide the command to run on all instances.', cli.stderr(cp))
+        finally:
+            util.delete_token(self.waiter_url, token_name, kill_services=True)
+
     def test_ssh_service_id_single_instance(self):
         self.__test_ssh(lambda _, instances: instances['active-instances'], test_service=True)
 
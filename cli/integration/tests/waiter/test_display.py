@@ -0,0 +1,44 @@
+import pytest
+from tabulate import tabulate
+
+from waiter import display
+
+
+def tabulate_plain(columns):
+    return tabulate({header: values for header, values in columns}, headers='keys', tablefmt='plain')
+
+
+@pytest.mark.cli
+def test_table_lines_match_tabulate():
+    columns = [('Count', ['1,000', '2', None, '30']),
+               ('Ratio', [0.5, 12.25, 3, None]),
+               ('Name', ['a', '日本語', '\x1b[32mok\x1b[0m', '']),
+               ('Flag', [True, False, None, True])]
+    # e.g. whether thousands separators make a column numeric depends on the version of tabulate
+    assert '\n'.join(display.table_lines(columns)) == tabulate_plain(columns)
+
+
+@pytest.mark.cli
+def test_table_rows_stay_on_one_line():
+    columns = [('Name', ['a\nb', 'c']), ('Size', [1, 22])]
+    header_line, row_lines = display.table_rows(columns)
+    assert header_line == 'Name      Size'
+    assert list(row_lines) == ['a b          1',
+                               'c           22']
+
+
+@pytest.mark.cli
+def test_visible_width():
+    assert display.visible_width('abc') == 3
+    assert display.visible_width('\x1b[1mabc\x1b[0m') == 3
+    assert display.visible_width('日本語') == 6
+
+
+@pytest.mark.cli
+def test_truncate_line():
+    assert display.truncate_line('abcdef', 6) == 'abcdef'
+    assert display.truncate_line('abcdef', 4) == 'abc…'
+    assert display.truncate_line('\x1b[1mabcdef\x1b[0m', 4) == '\x1b[1mabc\x1b[0m…'
+    # a wide character never straddles the edge
+    assert display.truncate_line('a日本語', 5) == 'a日…'
+    assert display.visible_width(display.truncate_line('日本語日本語', 6)) <= 6
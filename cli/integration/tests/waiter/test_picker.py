@@ -0,0 +1,70 @@
+import pytest
+
+from waiter import display, picker
+
+
+@pytest.mark.cli
+def test_fuzzy_score():
+    assert picker.fuzzy_score('abc', 'xxabcxx') == (0, 2)
+    assert picker.fuzzy_score('abc', 'axbxc') == (1, 4)
+    assert picker.fuzzy_score('abc', 'axxbc') == (1, 4)
+    assert picker.fuzzy_score('abc', 'acb') is None
+    assert picker.fuzzy_score('abc', 'xyz') is None
+    # exact substrings rank before scattered matches, and tighter matches before looser ones
+    scores = [picker.fuzzy_score('svc', t) for t in ['my-svc', 's-v-c', 'service']]
+    assert scores == [(0, 3), (1, 4), (1, 5)]
+    assert picker.fuzzy_score('sc', 'sxc') < picker.fuzzy_score('sc', 'sxxc')
+
+
+@pytest.mark.cli
+def test_search_index():
+    index = picker.SearchIndex(['service-one', 'Service-Two', 'other', '\x1b[32mserv\x1b[0mice'])
+    assert index.search('') == [0, 1, 2, 3]
+    # matching is case insensitive and ignores terminal colors
+    assert index.search('SERV') == [0, 1, 3]
+    assert index.search('servi') == [0, 1, 3]
+    # the tightest scattered matches come first
+    assert index.search('servo') == [0, 1]
+    assert index.search('sero') == [0, 1]
+    assert index.search('tw') == [1]
+    assert index.search('xyz') == []
+
+
+@pytest.mark.cli
+def test_search_index_reuses_prefix_matches():
+    index = picker.SearchIndex(['abc', 'abd', 'xyz'])
+    assert index.search('ab') == [0, 1]
+    # only the candidates matching the longest known prefix of the query are searched again
+    index.texts[2] = 'abcabc'
+    assert index.search('abc') == [0]
+    assert index.search('ab') == [0, 1]
+    assert set(index.matches) == {'', 'ab', 'abc'}
+
+
+@pytest.mark.cli
+def test_split_keys():
+    assert picker.split_keys('') == []
+    assert picker.split_keys('ab') == ['a', 'b']
+    assert picker.split_keys('a\x1b[Ab\x1bOB') == ['a', '\x1b[A', 'b', '\x1bOB']
+    # a lone escape cancels the picker
+    assert picker.split_keys('\x1b') == ['\x1b']
+    assert picker.split_keys('\x7f\r') == ['\x7f', '\r']
+
+
+@pytest.mark.cli
+def test_table_rows_map_to_items():
+    instances = [{'id': 'svc.1', 'host': 'host-one', 'healthy?': True, '_status': 'healthy'},
+                 {'id': 'svc.22', 'host': 'h2', 'healthy?': False, '_status': 'failed'}]
+    columns = display.service_instance_columns(instances, show_index=True, column_names=['Instance Id', 'Host'])
+    header_line, row_lines = display.table_rows(columns)
+    rows = list(row_lines)
+    assert header_line == 'Index    Instance Id    Host'
+    assert rows == ['[1]      svc.1          host-one',
+                    '[2]      svc.22         h2']
+    assert [header_line, *rows] == list(display.table_lines(columns))
+
+
+@pytest.mark.cli
+def test_pick_requires_one_row_per_item():
+    with pytest.raises(Exception, match='one row per item'):
+        picker.pick(['a', 'b'], ['Header'], ['a'])
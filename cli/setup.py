@@ -16,7 +16,12 @@ test_requirements = [
     'retrying'
 ]
 
+fast_requirements = [
+    'orjson>=3.0'
+]
+
 extras = {
+    'fast': fast_requirements,
     'test': test_requirements,
 }
 
@@ -6,13 +6,19 @@ import signal
 import sys
 
 from waiter.cli import run
-from waiter.util import print_error
+from waiter.util import is_agent_enabled, print_error
 
 
 def main(args=None, plugins={}):
     if args is None:
         args = sys.argv[1:]
 
+    if is_agent_enabled():
+        from waiter import agent
+        result = agent.forward(args)
+        if result is not None:
+            sys.exit(result)
+
     try:
         result = run(args, plugins)
         sys.exit(result)
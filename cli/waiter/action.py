@@ -3,12 +3,10 @@ import logging
 import requests
 from urllib.parse import urljoin
 
-from tabulate import tabulate
-
 from waiter import http_util, terminal
 from waiter.format import format_last_request_time
 from waiter.format import format_status
-from waiter.querying import get_service, get_services_using_token
+from waiter.querying import get_cluster_config_name, get_service, get_services_using_token
 from waiter.querying import print_no_data, query_service, query_services, query_token
 from waiter.util import is_service_current, str2bool, response_message, print_error, wait_until
 
@@ -164,6 +162,7 @@ def process_kill_request(clusters, token_name_or_service_id, is_service_id, forc
     """Kills the service(s) using the given token name or service-id.
     Returns False if no services can be found or if there was a failure in deleting any service.
     Returns True if all services using the token were deleted successfully."""
+    from tabulate import tabulate
     if is_service_id:
         query_result = query_service(clusters, token_name_or_service_id)
         num_services = query_result['count']
@@ -241,8 +240,7 @@ def process_kill_request(clusters, token_name_or_service_id, is_service_id, forc
 
 def token_explicitly_created_on_cluster(cluster, token_cluster_name):
     """Returns true if the given token cluster matches the configured cluster name of the given cluster"""
-    cluster_settings, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, '/settings'))
-    cluster_config_name = cluster_settings['cluster-config']['name'].upper()
+    cluster_config_name = get_cluster_config_name(cluster).upper()
     created_on_this_cluster = token_cluster_name == cluster_config_name
     return created_on_this_cluster
 
@@ -0,0 +1,265 @@
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+from waiter import version
+from waiter.util import cache_file_path, print_error
+
+# Sub-commands that always run in the invoking process: ssh replaces the process with ssh or kubectl,
+# logs can follow the log files until it is interrupted, and the agent sub-command manages the agent itself
+LOCAL_ACTIONS = ['agent', 'logs', 'ssh']
+
+# How long a thin invocation waits for an agent it started on demand to accept connections
+STARTUP_TIMEOUT_SECS = 5
+
+# How long the agent keeps running without receiving any command
+DEFAULT_IDLE_TIMEOUT_SECS = 1800
+
+
+def socket_path():
+    """Returns the path of the agent's Unix domain socket; every CLI version has its own agent"""
+    return cache_file_path(f'agent-{version.VERSION}.sock')
+
+
+def send_message(sock, message):
+    """Sends the given message as a line of JSON"""
+    sock.sendall(f'{json.dumps(message)}\n'.encode())
+
+
+def receive_message(reader):
+    """Returns the next message read from the given socket reader, or None when the peer has closed the socket"""
+    line = reader.readline()
+    return json.loads(line) if line else None
+
+
+def connect():
+    """Returns a socket connected to the agent, raising an OSError if the agent is not running"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+        return sock
+    except OSError:
+        sock.close()
+        raise
+
+
+def is_running():
+    """Returns true if the agent accepts connections"""
+    try:
+        connect().close()
+        return True
+    except OSError:
+        return False
+
+
+def start_in_background(idle_timeout_secs=DEFAULT_IDLE_TIMEOUT_SECS):
+    """Starts a detached agent and waits for it to accept connections, returns true if it does in time"""
+    command = [sys.executable, sys.argv[0], 'agent', 'serve', '--idle-timeout', str(idle_timeout_secs)]
+    logging.debug(f'starting the agent: {command}')
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    deadline = time.time() + STARTUP_TIMEOUT_SECS
+    while time.time() < deadline:
+        if is_running():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def stop():
+    """Asks the agent to exit, returns true if an agent was running"""
+    try:
+        with connect() as sock:
+            send_message(sock, {'stop': True})
+            receive_message(sock.makefile('rb'))
+        return True
+    except OSError:
+        return False
+
+
+def forward(args):
+    """
+    Runs the command with the given arguments in the agent, starting the agent on demand, and streams its output
+    and exit code back. Returns None if the command must run locally or if the agent could not be reached.
+    """
+    from waiter.cli import find_action
+    if find_action(args) in LOCAL_ACTIONS:
+        return None
+    try:
+        sock = connect()
+    except OSError:
+        if not start_in_background():
+            logging.info('unable to start the agent, running the command locally')
+            return None
+        sock = connect()
+    env = dict(os.environ)
+    if sys.stdout.isatty():
+        env.setdefault('COLUMNS', str(shutil.get_terminal_size().columns))
+    with sock:
+        send_message(sock, {'args': args,
+                            'cwd': os.getcwd(),
+                            'env': env,
+                            'stdin-tty': sys.stdin.isatty(),
+                            'stdout-tty': sys.stdout.isatty(),
+                            'stderr-tty': sys.stderr.isatty()})
+        try:
+            return relay_messages(sock)
+        except BrokenPipeError:
+            # the reader of our output went away (e.g. | head), stop writing like a local command would
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 1
+
+
+def relay_messages(sock):
+    """Relays the agent's output and the invoking process' input until the agent reports the exit code"""
+    reader = sock.makefile('rb')
+    while True:
+        message = receive_message(reader)
+        if message is None:
+            print_error('The waiter agent exited before the command completed.')
+            return 1
+        elif 'stdout' in message:
+            sys.stdout.write(message['stdout'])
+            sys.stdout.flush()
+        elif 'stderr' in message:
+            sys.stderr.write(message['stderr'])
+            sys.stderr.flush()
+        elif 'read' in message:
+            data = sys.stdin.readline() if message['read'] == 'line' else sys.stdin.read()
+            send_message(sock, {'stdin': data})
+        elif 'exit' in message:
+            return message['exit']
+
+
+class ForwardedOutput(io.TextIOBase):
+    """A text stream whose writes are forwarded to the invoking process as messages"""
+
+    def __init__(self, channel, name, tty):
+        self.channel = channel
+        self.name = name
+        self.tty = tty
+
+    def write(self, s):
+        if s:
+            self.channel.send({self.name: s})
+        return len(s)
+
+    def isatty(self):
+        return self.tty
+
+    def writable(self):
+        return True
+
+
+class ForwardedInput(io.TextIOBase):
+    """A text stream whose reads are served by the standard input of the invoking process"""
+
+    def __init__(self, channel, tty):
+        self.channel = channel
+        self.tty = tty
+
+    def readline(self, size=-1):
+        return self.channel.request_input('line')
+
+    def read(self, size=-1):
+        return self.channel.request_input('all')
+
+    def isatty(self):
+        return self.tty
+
+    def readable(self):
+        return True
+
+
+class Channel:
+    """The connection to an invoking process, which can be written to from multiple threads"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            send_message(self.sock, message)
+
+    def receive(self):
+        return receive_message(self.reader)
+
+    def request_input(self, mode):
+        with self.lock:
+            send_message(self.sock, {'read': mode})
+            message = receive_message(self.reader)
+        return message['stdin'] if message else ''
+
+
+def handle_command(channel, request, plugins):
+    """Runs the requested command with the invoking process' directory, environment and standard streams"""
+    from waiter.cli import run_command
+    saved_cwd = os.getcwd()
+    saved_env = dict(os.environ)
+    saved_stdin = sys.stdin
+    try:
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.stdin = ForwardedInput(channel, request['stdin-tty'])
+        with redirect_stdout(ForwardedOutput(channel, 'stdout', request['stdout-tty'])), \
+                redirect_stderr(ForwardedOutput(channel, 'stderr', request['stderr-tty'])):
+            exit_code = run_command(request['args'], plugins)
+        channel.send({'exit': exit_code})
+    finally:
+        sys.stdin = saved_stdin
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+
+
+def serve(plugins, idle_timeout_secs):
+    """
+    Accepts commands on the agent's socket until it is stopped or has been idle for the given time. Commands run
+    one at a time, since each of them takes over the process' directory, environment and standard streams, but
+    they share the process' HTTP session, connection pools and caches.
+    """
+    path = socket_path()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(path):
+        if is_running():
+            raise Exception(f'The agent is already running on {path}.')
+        os.remove(path)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+    server.settimeout(idle_timeout_secs)
+    logging.info(f'agent listening on {path}')
+    try:
+        while True:
+            try:
+                sock, _ = server.accept()
+            except socket.timeout:
+                logging.info(f'agent has been idle for {idle_timeout_secs} seconds, exiting')
+                return
+            with sock:
+                sock.settimeout(None)
+                channel = Channel(sock)
+                try:
+                    request = channel.receive()
+                    if request is None:
+                        continue
+                    if request.get('stop'):
+                        channel.send({'exit': 0})
+                        return
+                    handle_command(channel, request, plugins)
+                except OSError as e:
+                    logging.warning(f'lost the connection to the invoking process: {e}')
+    finally:
+        server.close()
+        os.remove(path)
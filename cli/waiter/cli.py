@@ -1,65 +1,101 @@
 import argparse
+import importlib
 import logging
+import time
 from urllib.parse import urlparse
 
-from waiter import configuration, http_util, metrics, version
-from waiter.subcommands import create, delete, init, kill, maintenance, ping, show, ssh, tokens, update
+from waiter import configuration, metrics, name_index, version
 import waiter.plugins as waiter_plugins
-
-parser = argparse.ArgumentParser(description='waiter is the Waiter CLI')
-parser.add_argument('--cluster', '-c', help='the name of the Waiter cluster to use')
-parser.add_argument('--url', '-u', help='the url of the Waiter cluster to use')
-parser.add_argument('--config', '-C', help='the configuration file to use')
-parser.add_argument('--verbose', '-v', help='be more verbose/talkative (useful for debugging)',
-                    dest='verbose', action='store_true')
-parser.add_argument('--version', help='output version information and exit',
-                    version=f'%(prog)s version {version.VERSION}', action='version')
-
-subparsers = parser.add_subparsers(dest='action')
-
-actions = {
-    'create': {
-        'run-function': create.register(subparsers.add_parser),
-        'implicit-args-function': create.add_implicit_arguments
-    },
-    'delete': {
-        'run-function': delete.register(subparsers.add_parser)
-    },
-    'init': {
-        'run-function': init.register(subparsers.add_parser),
-        'implicit-args-function': init.add_implicit_arguments
-    },
-    'kill': {
-        'run-function': kill.register(subparsers.add_parser)
-    },
-    'maintenance': {
-        'run-function': maintenance.register(subparsers.add_parser)
-    },
-    'ping': {
-        'run-function': ping.register(subparsers.add_parser)
-    },
-    'show': {
-        'run-function': show.register(subparsers.add_parser)
-    },
-    'ssh': {
-        'run-function': ssh.register(subparsers.add_parser)
-    },
-    'start': {
-        'run-function': maintenance.register_stop('start', subparsers.add_parser)
-    },
-    'stop': {
-        'run-function': maintenance.register_start('stop', subparsers.add_parser)
-    },
-    'tokens': {
-        'run-function': tokens.register(subparsers.add_parser)
-    },
-    'update': {
-        'run-function': update.register(subparsers.add_parser),
-        'implicit-args-function': update.add_implicit_arguments
-    }
+from waiter.util import print_error
+
+# Global flags that take a value, needed to find the sub-command in the arguments before parsing them
+GLOBAL_FLAGS_WITH_VALUES = ['--cluster', '-c', '--url', '-u', '--config', '-C']
+
+# Sub-commands are registered lazily, so that only the selected sub-command's module (and its dependencies)
+# gets imported and only its parser gets built. Each entry names the module in waiter.subcommands, the function
+# that registers the parser when it is not register(add_parser) but a register_xyz(command_name, add_parser)
+# function, and whether the sub-command accepts implicit token field arguments.
+subcommands = {
+    'agent': {'module': 'agent'},
+    'apply': {'module': 'apply', 'implicit-args': True},
+    'batch': {'module': 'batch'},
+    'completion': {'module': 'completion'},
+    'create': {'module': 'create', 'implicit-args': True},
+    'delete': {'module': 'delete'},
+    'init': {'module': 'init', 'implicit-args': True},
+    'kill': {'module': 'kill'},
+    'logs': {'module': 'logs'},
+    'maintenance': {'module': 'maintenance'},
+    'ping': {'module': 'ping'},
+    'show': {'module': 'show'},
+    'ssh': {'module': 'ssh'},
+    'start': {'module': 'maintenance', 'register-function': 'register_stop'},
+    'stop': {'module': 'maintenance', 'register-function': 'register_start'},
+    'tokens': {'module': 'tokens'},
+    'update': {'module': 'update', 'implicit-args': True}
 }
 
 
+def create_parser():
+    """
+    Returns a new parser with the global flags, along with its sub-command parsers. Every run uses a new parser,
+    so that the implicit arguments added by one run don't leak into later runs of the same process.
+    """
+    parser = argparse.ArgumentParser(description='waiter is the Waiter CLI')
+    parser.add_argument('--cluster', '-c', help='the name of the Waiter cluster to use')
+    parser.add_argument('--url', '-u', help='the url of the Waiter cluster to use')
+    parser.add_argument('--config', '-C', help='the configuration file to use')
+    parser.add_argument('--verbose', '-v', help='be more verbose/talkative (useful for debugging)',
+                        dest='verbose', action='store_true')
+    parser.add_argument('--version', help='output version information and exit',
+                        version=f'%(prog)s version {version.VERSION}', action='version')
+    subparsers = parser.add_subparsers(dest='action')
+    return parser, subparsers
+
+
+def register_action(subparsers, actions, action):
+    """Imports the module of the given sub-command and registers its parser, unless already registered"""
+    if action in actions:
+        return
+    subcommand = subcommands[action]
+    module = importlib.import_module(f'waiter.subcommands.{subcommand["module"]}')
+    register_function_name = subcommand.get('register-function')
+    if register_function_name:
+        run_function = getattr(module, register_function_name)(action, subparsers.add_parser)
+    else:
+        run_function = module.register(subparsers.add_parser)
+    actions[action] = {'run-function': run_function}
+    if subcommand.get('implicit-args', False):
+        actions[action]['implicit-args-function'] = module.add_implicit_arguments
+
+
+def find_action(args):
+    """Returns the sub-command named in the given arguments, without parsing them, or None if there is none"""
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+        elif arg in GLOBAL_FLAGS_WITH_VALUES:
+            skip_next = True
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def register_actions(subparsers, actions, args):
+    """
+    Registers the parsers needed to parse the given arguments: only the selected sub-command's when there is one.
+    Otherwise the help output lists every sub-command, so all of them are registered, unless only the version
+    was requested.
+    """
+    action = find_action(args)
+    if action in subcommands:
+        register_action(subparsers, actions, action)
+    elif action is not None or '--version' not in args:
+        for name in subcommands:
+            register_action(subparsers, actions, name)
+
+
 def load_target_clusters(config_map, url=None, cluster=None):
     """Given the config and (optional) url and cluster flags, returns the list of clusters to target"""
     if cluster and url:
@@ -84,28 +120,40 @@ def load_target_clusters(config_map, url=None, cluster=None):
     return clusters
 
 
-def run(args, plugins):
+def parse_args(args):
     """
-    Main entrypoint to the Waiter CLI. Loads configuration files,
-    processes global command line arguments, and calls other command line 
-    sub-commands (actions) if necessary.
+    Parses the given arguments with a new parser and configures logging accordingly, returning the parsed
+    arguments, the registered sub-commands and the parser
     """
-    args, unknown_args = parser.parse_known_args(args)
-    verbose = args.verbose
+    parser, subparsers = create_parser()
+    actions = {}
+    register_actions(subparsers, actions, args)
+    known_args, unknown_args = parser.parse_known_args(args)
+    verbose = known_args.verbose
     if verbose:
         log_format = '%(asctime)s [%(levelname)s] [%(name)s] %(message)s'
+        logging.disable(logging.NOTSET)
         logging.getLogger('').handlers = []
         logging.basicConfig(format=log_format, level=logging.DEBUG)
     else:
         logging.disable(logging.FATAL)
 
-    if args.action:
-        add_implicit_arguments = actions[args.action].get('implicit-args-function', None)
+    if known_args.action:
+        add_implicit_arguments = actions[known_args.action].get('implicit-args-function', None)
         if add_implicit_arguments:
             add_implicit_arguments(unknown_args)
 
-    args = parser.parse_args()
-    args = vars(args)
+    return vars(parser.parse_args(args)), actions, parser
+
+
+def run(args, plugins):
+    """
+    Main entrypoint to the Waiter CLI. Loads configuration files,
+    processes global command line arguments, and calls other command line 
+    sub-commands (actions) if necessary.
+    """
+    start_time = time.perf_counter()
+    args, actions, parser = parse_args(args)
     logging.debug('args: %s', args)
     args.pop('verbose')
 
@@ -120,6 +168,8 @@ def run(args, plugins):
     if action is None:
         parser.print_help()
     else:
+        # imported on first use, since importing requests is a significant part of the startup time
+        from waiter import http_util
         config_map = configuration.load_config_with_defaults(config_path)
         try:
             metrics.initialize(config_map)
@@ -136,6 +186,27 @@ def run(args, plugins):
                 metrics.inc(f'command.{action}.result.failure')
             return result
         finally:
+            from waiter import querying
+            name_index.update_after_command(config_map, config_path, action, querying.pop_seen_service_ids())
+            metrics.timing(f'command.{action}.latency', (time.perf_counter() - start_time) * 1000)
             metrics.close()
 
     return None
+
+
+def run_command(args, plugins):
+    """
+    Runs the command with the given arguments like the waiter entrypoint does, but returns
+    its exit code instead of exiting, so that a process can run several commands
+    """
+    try:
+        return run(args, plugins) or 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print_error(str(e.code))
+        return 1
+    except Exception as e:
+        logging.exception('exception when running with %s' % args)
+        print_error(str(e))
+        return 1
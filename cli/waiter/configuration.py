@@ -1,9 +1,11 @@
+import hashlib
 import json
 import logging
 import os
 import sys
 
-from waiter.util import deep_merge, load_json_file
+from waiter import version
+from waiter.util import cache_file_path, deep_merge, load_json_file, write_json_file_atomically
 
 # Base locations to check for configuration files, relative to the executable.
 # Always tries to load these in.
@@ -19,9 +21,18 @@ DEFAULT_CONFIG = {'http': {'retries': 2,
                            'connect-timeout': 3.05,
                            'read-timeout': 20},
                   'metrics': {'disabled': True,
+                              'flush-timeout': 0.1,
                               'max-retries': 2,
+                              'protocol': 'tcp',
+                              'spool-max-bytes': 1048576,
                               'timeout': 0.15}}
 
+# Name of the cache file holding recently compiled (merged) configurations
+CONFIG_CACHE_FILE_NAME = 'config-cache.json'
+
+# Maximum number of compiled configurations kept in the cache, e.g. for different --config paths
+MAX_CACHED_CONFIGS = 16
+
 
 def __load_first_json_file(paths):
     """Returns the contents of the first parseable JSON file in a list of paths."""
@@ -65,7 +76,7 @@ def __prepend_additional_clusters(config):
         del config['additional-clusters']
 
 
-def load_config_with_defaults(config_path=None):
+def __compile_config(config_path):
     """Loads the configuration map to use, merging in the defaults"""
     base_config = __load_base_config()
     base_config = base_config or {}
@@ -74,5 +85,74 @@ def load_config_with_defaults(config_path=None):
     config = config or {}
     config = deep_merge(base_config, config)
     __prepend_additional_clusters(config)
+    return config
+
+
+def __candidate_paths(config_path):
+    """Returns the absolute paths of every file that can contribute to the configuration"""
+    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    paths = [os.path.join(base_dir, path) for path in BASE_CONFIG_PATHS]
+    paths.extend([config_path] if config_path else ADDITIONAL_CONFIG_PATHS)
+    return [os.path.abspath(p) for p in paths]
+
+
+def __file_signature(path):
+    """Returns the [mtime, size, inode] signature of the file, or None if there is no such file"""
+    try:
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+    except OSError:
+        return None
+
+
+def __cache_key(paths):
+    """Returns the key of the compiled configuration, which also covers the CLI version and default config"""
+    key_data = json.dumps([version.VERSION, DEFAULT_CONFIG, paths], sort_keys=True)
+    return hashlib.sha256(key_data.encode()).hexdigest()
+
+
+def __load_config_cache(cache_path):
+    """Returns the cached compiled configurations, keyed by cache key"""
+    try:
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logging.exception(f'unable to load the configuration cache from {cache_path}')
+        return {}
+
+
+def load_config_with_defaults(config_path=None):
+    """
+    Loads the configuration map to use, merging in the defaults. The compiled configuration is cached
+    along with the signatures (mtime, size and inode) of all the files that could contribute to it,
+    and is reused until any of those files is created, changed or removed.
+    """
+    paths = __candidate_paths(config_path)
+    signatures = [__file_signature(p) for p in paths]
+    key = __cache_key(paths)
+    try:
+        cache_path = cache_file_path(CONFIG_CACHE_FILE_NAME)
+    except OSError:
+        logging.exception('unable to access the configuration cache directory')
+        cache_path = None
+
+    cache = __load_config_cache(cache_path) if cache_path else {}
+    entry = cache.get(key)
+    if entry and entry['signatures'] == signatures:
+        logging.debug(f'using cached configuration compiled from {paths}')
+        config = entry['config']
+    else:
+        config = __compile_config(config_path)
+        if cache_path:
+            cache.pop(key, None)
+            # dicts preserve insertion order, so the oldest entries come first
+            retained_keys = list(cache.keys())[-(MAX_CACHED_CONFIGS - 1):]
+            cache = {**{k: cache[k] for k in retained_keys}, key: {'config': config, 'signatures': signatures}}
+            try:
+                write_json_file_atomically(cache_path, cache)
+            except Exception:
+                logging.exception(f'unable to write the configuration cache to {cache_path}')
     logging.debug(f'using configuration: {config}')
     return config
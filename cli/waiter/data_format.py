@@ -1,10 +1,31 @@
+import itertools
 import json
 import logging
 import os
 import string
 import sys
+import textwrap
+from functools import lru_cache
 
-import yaml
+# orjson is an optional, faster JSON parser
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@lru_cache(maxsize=None)
+def yaml_codec():
+    """
+    Imports yaml on first use, since most commands never need it, and returns the (yaml, loader, dumper) triple.
+    The libyaml-backed loader and dumper are preferred, as they are much faster than the pure-Python ones.
+    """
+    import yaml
+    try:
+        from yaml import CSafeDumper as YamlSafeDumper, CSafeLoader as YamlSafeLoader
+    except ImportError:
+        from yaml import SafeDumper as YamlSafeDumper, SafeLoader as YamlSafeLoader
+    return yaml, YamlSafeLoader, YamlSafeDumper
 
 
 class DataFormat:
@@ -27,6 +48,13 @@ class DataFormat:
         """
         raise NotImplementedError('Method has not been implemented!')
 
+    def dump_query_result_chunks(self, cluster_entries):
+        """
+        Given (cluster_name, entities) pairs in sorted cluster name order, yields strings that together
+        are the representation of the query result {'clusters': {...}, 'count': n}, one cluster at a time.
+        """
+        raise NotImplementedError('Method has not been implemented!')
+
 
 class JsonDataFormat(DataFormat):
     def name(self):
@@ -35,17 +63,40 @@ class JsonDataFormat(DataFormat):
     def parse(self, data):
         try:
             logging.debug(f'parsing input data as json')
-            content = json.loads(data)
+            content = self.__loads(data)
             return content
         except Exception:
             raise ValueError('Malformed JSON in input.')
 
+    @staticmethod
+    def __loads(data):
+        """Parses the JSON string using orjson when available, falling back to the json module"""
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # e.g. NaN or integers larger than 64 bits, which only the json module accepts
+                logging.debug('orjson failed to parse input data, retrying with the json module')
+        return json.loads(data)
+
     def dump(self, out_data, out_file=None):
         if out_file:
             json.dump(out_data, out_file, indent=2, sort_keys=True)
         else:
             return json.dumps(out_data, indent=2, sort_keys=True)
 
+    def dump_query_result_chunks(self, cluster_entries):
+        count = 0
+        prefix = '{\n  "clusters": {\n'
+        for cluster_name, entities in cluster_entries:
+            cluster_json = json.dumps({cluster_name: entities}, indent=2, sort_keys=True)
+            # drop the enclosing braces and indent the entry to its depth inside the "clusters" object
+            yield prefix + textwrap.indent(cluster_json[2:-2], '  ')
+            prefix = ',\n'
+            count += entities['count']
+        yield '{\n  "clusters": {},\n' if prefix.startswith('{') else '\n  },\n'
+        yield f'  "count": {count}\n}}\n'
+
 
 class YamlDataFormat(DataFormat):
     def name(self):
@@ -54,20 +105,60 @@ class YamlDataFormat(DataFormat):
     def parse(self, data):
         try:
             logging.debug(f'parsing input data as yaml')
-            content = yaml.safe_load(data)
+            yaml, yaml_loader, _ = yaml_codec()
+            content = yaml.load(data, Loader=yaml_loader)
             return content
         except Exception:
             raise ValueError('Malformed YAML in input.')
 
     def dump(self, out_data, out_file=None):
+        yaml, _, yaml_dumper = yaml_codec()
+        if out_file:
+            yaml.dump(out_data, out_file, Dumper=yaml_dumper)
+        else:
+            return yaml.dump(out_data, Dumper=yaml_dumper)
+
+    def dump_query_result_chunks(self, cluster_entries):
+        yaml, _, yaml_dumper = yaml_codec()
+        count = 0
+        prefix = 'clusters:\n'
+        for cluster_name, entities in cluster_entries:
+            # dumping the entry nested under "clusters" keeps line wrapping identical to dumping the whole result
+            cluster_yaml = yaml.dump({'clusters': {cluster_name: entities}}, Dumper=yaml_dumper)
+            yield prefix + cluster_yaml[len('clusters:\n'):]
+            prefix = ''
+            count += entities['count']
+        yield f'clusters: {{}}\ncount: {count}\n\n' if prefix else f'count: {count}\n\n'
+
+
+class NdjsonDataFormat(DataFormat):
+    def name(self):
+        return 'ndjson'
+
+    def parse(self, data):
+        try:
+            logging.debug(f'parsing input data as ndjson')
+            return [JSON.parse(line) for line in data.splitlines() if line.strip()]
+        except Exception:
+            raise ValueError('Malformed NDJSON in input.')
+
+    @staticmethod
+    def dump_record(record):
+        """Returns the single-line JSON representation of the record"""
+        return json.dumps(record, sort_keys=True, separators=(',', ':'))
+
+    def dump(self, out_data, out_file=None):
+        records = out_data if isinstance(out_data, list) else [out_data]
         if out_file:
-            yaml.safe_dump(out_data, out_file)
+            for record in records:
+                out_file.write(f'{self.dump_record(record)}\n')
         else:
-            return yaml.safe_dump(out_data)
+            return '\n'.join(self.dump_record(record) for record in records)
 
 
 JSON = JsonDataFormat()
 YAML = YamlDataFormat()
+NDJSON = NdjsonDataFormat()
 
 
 class AnySupportedFormat(DataFormat):
@@ -76,12 +167,13 @@ class AnySupportedFormat(DataFormat):
 
     def parse(self, data):
         content = None
-        for input_format in [JSON, YAML]:
+        input_formats = [JSON, YAML] if sniff_format(data) is JSON else [YAML]
+        for input_format in input_formats:
             try:
                 logging.debug(f'attempting to parse input data as {input_format}')
                 content = input_format.parse(data)
                 logging.debug(f'successfully parsed input data as {input_format}')
-                continue
+                break
             except Exception:
                 logging.debug(f'error parsing input data as {input_format}')
         if content is None:
@@ -95,23 +187,39 @@ class AnySupportedFormat(DataFormat):
 ANY_FORMAT = AnySupportedFormat()
 
 
+def sniff_format(data):
+    """
+    Cheaply guesses the format of the data from its first non-whitespace character.
+    JSON documents that are objects or arrays start with { or [, anything else can only be YAML.
+    Since YAML flow collections also start with { or [, a JSON guess may still need to fall back to YAML.
+    """
+    first_char = data.lstrip()[:1]
+    return JSON if first_char in ('{', '[') else YAML
+
+
 def validate_options(options):
     """Validates whether unique file format is specified."""
     as_json = options.get(JSON.name())
     as_yaml = options.get(YAML.name())
+    as_ndjson = options.get(NDJSON.name())
     if as_json and as_yaml:
         raise Exception(f'JSON and YAML mode cannot be used simultaneously!')
+    if as_ndjson and (as_json or as_yaml):
+        raise Exception(f'NDJSON mode cannot be used simultaneously with JSON or YAML mode!')
 
 
 def determine_format(options):
     """
-    Determines whether the configured format is YAML or JSON.
-    JSON is the default format if YAML is not explicitly enabled.
+    Determines whether the configured format is YAML, NDJSON or JSON.
+    JSON is the default format if neither YAML nor NDJSON is explicitly enabled.
     """
     validate_options(options)
-    as_yaml = options.get(YAML.name())
-    data_format = YAML if as_yaml else JSON
-    return data_format
+    if options.get(YAML.name()):
+        return YAML
+    elif options.get(NDJSON.name()):
+        return NDJSON
+    else:
+        return JSON
 
 
 def read_from_standard_input(input_format):
@@ -139,12 +247,58 @@ def load_file(path):
     return content
 
 
-def load_data(options):
+def load_context_file(context_file, description='context'):
+    """Loads and parses the JSON/YAML context file"""
+    logging.debug(f'reading {description} from {context_file}')
+    context_content = load_file(context_file)
+    if not context_content:
+        raise Exception(f'Unable to load {description} from {context_file}.')
+    return YAML.parse(context_content)
+
+
+def load_context_matrix(context_matrix_file):
     """
-    Decode a JSON/YAML formatted file.
-    Data must be a dict of attributes.
-    Throws a ValueError if there is a problem parsing the data.
+    Loads the list of contexts described by the context matrix file. The file either evaluates to a list of
+    dictionaries, each of which is one context, or to a dictionary whose list values are expanded into their
+    cartesian product (non-list values are shared by every context).
     """
+    matrix = load_context_file(context_matrix_file, description='context matrix')
+    if isinstance(matrix, list):
+        if not all(isinstance(context, dict) for context in matrix):
+            raise Exception(f'Provided context matrix list must only contain dictionaries, instead it is {matrix}')
+        contexts = matrix
+    elif isinstance(matrix, dict):
+        keys = list(matrix.keys())
+        axes = [v if isinstance(v, list) else [v] for v in matrix.values()]
+        contexts = [dict(zip(keys, values)) for values in itertools.product(*axes)]
+    else:
+        raise Exception(f'Provided context matrix file must evaluate to a list or a dictionary, instead it is {matrix}')
+    if not contexts:
+        raise Exception(f'Provided context matrix file {context_matrix_file} does not contain any context.')
+    return contexts
+
+
+def render_template(string_template, context_dict):
+    """Substitutes the context variables into the string template"""
+    try:
+        logging.debug(f'applying string templating to input using context {context_dict}')
+        return string_template.substitute(context_dict)
+    except Exception as ex:
+        message = f'missing variable {ex}' if isinstance(ex, KeyError) else str(ex)
+        raise Exception(f'Error when processing template: {message}')
+
+
+def parse_attributes(input_format, content):
+    """Parses the content in the input format, which must be a dict of attributes"""
+    content = input_format.parse(content)
+    if type(content) is dict:
+        return content
+    else:
+        raise ValueError(f'Input {input_format} must be a dictionary of attributes.')
+
+
+def load_input_content(options):
+    """Reads the raw JSON/YAML input from the file (or stdin) in the options, returns the (format, content) pair"""
     input_format = ANY_FORMAT if options.get('data') else determine_format(options)
     input_file = options.get(input_format.name())
 
@@ -158,42 +312,59 @@ def load_data(options):
         content = load_file(input_file)
         if not content:
             raise Exception(f'Unable to load {input_format} from {input_file}.')
+    return input_format, content
 
-        context_dict = {}
-        context_provided = False
-        context_file = options.get('context_file')
-        if context_file:
-            context_provided = True
-            logging.debug(f'reading context from {context_file}')
-            context_content = load_file(context_file)
-            if not context_content:
-                raise Exception(f'Unable to load context from {context_file}.')
-
-            context_file_obj = YAML.parse(context_content)
-            if not isinstance(context_file_obj, dict):
-                raise Exception(f'Provided context file must evaluate to a dictionary, instead it is {context_file_obj}')
-            context_dict.update(context_file_obj)
-
-        context_overrides = options.get('context_overrides')
-        if context_overrides:
-            context_provided = True
-            logging.debug(f'merging additional context {context_overrides}')
-            context_dict.update(context_overrides)
-
-        if context_provided:
-            try:
-                logging.debug(f'applying string templating to input using context {context_dict}')
-                string_template = string.Template(content)
-                content = string_template.substitute(context_dict)
-            except Exception as ex:
-                message = f'missing variable {ex}' if isinstance(ex, KeyError) else str(ex)
-                raise Exception(f'Error when processing template: {message}')
 
-    content = input_format.parse(content)
-    if type(content) is dict:
-        return content
-    else:
-        raise ValueError(f'Input {input_format} must be a dictionary of attributes.')
+def load_base_context(options):
+    """Returns the context dictionary from the context file and overrides, or None if no context was provided"""
+    context_dict = {}
+    context_provided = False
+    context_file = options.get('context_file')
+    if context_file:
+        context_provided = True
+        context_file_obj = load_context_file(context_file)
+        if not isinstance(context_file_obj, dict):
+            raise Exception(f'Provided context file must evaluate to a dictionary, instead it is {context_file_obj}')
+        context_dict.update(context_file_obj)
+
+    context_overrides = options.get('context_overrides')
+    if context_overrides:
+        context_provided = True
+        logging.debug(f'merging additional context {context_overrides}')
+        context_dict.update(context_overrides)
+
+    return context_dict if context_provided else None
+
+
+def load_data(options):
+    """
+    Decode a JSON/YAML formatted file.
+    Data must be a dict of attributes.
+    Throws a ValueError if there is a problem parsing the data.
+    """
+    input_format, content = load_input_content(options)
+    if options.get(input_format.name()) != '-':
+        context_dict = load_base_context(options)
+        if context_dict is not None:
+            content = render_template(string.Template(content), context_dict)
+    return parse_attributes(input_format, content)
+
+
+def load_data_matrix(options, contexts):
+    """
+    Decodes a JSON/YAML formatted template file once for every context in the given list.
+    The template is read and compiled once; each context is layered between the context file and the overrides.
+    Returns the list of dicts of attributes, in the order of the contexts.
+    """
+    input_format, content = load_input_content(options)
+    if options.get(input_format.name()) == '-':
+        raise Exception('A context matrix cannot be used with input from stdin.')
+    context_dict = load_base_context(options) or {}
+    context_overrides = options.get('context_overrides') or {}
+    string_template = string.Template(content)
+    return [parse_attributes(input_format,
+                             render_template(string_template, {**context_dict, **context, **context_overrides}))
+            for context in contexts]
 
 
 def display_data(options, data):
@@ -202,3 +373,48 @@ def display_data(options, data):
     result = input_format.dump(data)
     if result:
         print(result)
+
+
+def in_cluster_name_order(cluster_names, cluster_results):
+    """
+    Given (cluster_name, entities) pairs that arrive in any order, yields the pairs with a non-zero count in sorted
+    cluster name order, each as soon as it and all the clusters sorted before it have arrived
+    """
+    remaining_names = sorted(cluster_names, reverse=True)
+    pending = {}
+    for cluster_name, entities in cluster_results:
+        pending[cluster_name] = entities
+        while remaining_names and remaining_names[-1] in pending:
+            next_name = remaining_names.pop()
+            next_entities = pending.pop(next_name)
+            if next_entities['count'] > 0:
+                yield next_name, next_entities
+
+
+def display_query_result_stream(options, cluster_names, cluster_results, entities_to_records):
+    """
+    Displays a query result as JSON/YAML/NDJSON on standard output while the clusters are still being queried.
+    cluster_results yields (cluster_name, entities) pairs in completion order. NDJSON output writes the records
+    returned by entities_to_records(cluster_name, entities) as soon as each cluster arrives. JSON/YAML output is
+    identical to display_data on the complete query result, written one cluster at a time.
+    Returns the total count of entities.
+    """
+    output_format = determine_format(options)
+    counts = []
+
+    def counted(results):
+        for cluster_name, entities in results:
+            counts.append(entities['count'])
+            yield cluster_name, entities
+
+    if output_format is NDJSON:
+        for cluster_name, entities in counted(cluster_results):
+            for record in entities_to_records(cluster_name, entities):
+                sys.stdout.write(f'{NDJSON.dump_record(record)}\n')
+            sys.stdout.flush()
+    else:
+        ordered_results = in_cluster_name_order(cluster_names, counted(cluster_results))
+        for chunk in output_format.dump_query_result_chunks(ordered_results):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    return sum(counts)
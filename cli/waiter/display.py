@@ -1,12 +1,106 @@
-import collections
-
-from tabulate import tabulate
+import functools
+import io
+import re
+import sys
 
 from waiter import terminal
-from waiter.format import format_last_request_time, format_mem_field, format_memory_amount, format_status
+from waiter.format import format_last_request_time, format_mem_field, format_memory_amount, format_status, \
+    TimestampFormatter
 from waiter.util import is_service_current, print_error
 
 
+# ANSI escape sequences (e.g. terminal colors) take up no space when displayed
+__ANSI_ESCAPE_PATTERN = re.compile(r'(\x1b\[[0-9;]*m)')
+
+
+def strip_ansi(s):
+    """Returns the given string without its ANSI escape sequences"""
+    return __ANSI_ESCAPE_PATTERN.sub('', s)
+
+
+@functools.lru_cache(maxsize=None)
+def __wcwidth_module():
+    """Returns the wcwidth module, which tabulate also uses when installed, or None if it is not installed"""
+    try:
+        import wcwidth
+        return wcwidth
+    except ImportError:
+        return None
+
+
+def __text_width(text):
+    """Returns the displayed width of the given text (without ANSI escape sequences), wide characters taking two"""
+    wcwidth = __wcwidth_module()
+    width = wcwidth.wcswidth(text) if wcwidth else -1
+    # wcswidth returns -1 for text holding control characters
+    return width if width >= 0 else len(text)
+
+
+def visible_width(s):
+    """Returns the displayed width of the given string, ignoring ANSI escape sequences"""
+    return __text_width(strip_ansi(s))
+
+
+def __single_line(value):
+    """Returns the given cell value, with any line breaks replaced by spaces so that the cell spans a single line"""
+    return value.replace('\n', ' ') if isinstance(value, str) else value
+
+
+def table_rows(columns):
+    """
+    Returns the header line of the table rendered by tabulate in its "plain" format,
+    along with a generator of the lines of its rows, one per value of the columns, in order.
+    The columns are passed to tabulate as is, so rows never need to be materialized as dictionaries.
+    :param columns: list of (header, values) pairs, all values lists having the same length
+    """
+    from tabulate import tabulate
+    table = tabulate({header: [__single_line(v) for v in values] for header, values in columns},
+                     headers='keys', tablefmt='plain')
+    lines = (line.rstrip('\n') for line in io.StringIO(table))
+    return next(lines), lines
+
+
+def table_lines(columns):
+    """
+    Yields the lines of the table rendered by tabulate in its "plain" format, so that
+    each line can be written (or truncated) as it is produced.
+    :param columns: list of (header, values) pairs, all values lists having the same length
+    """
+    header_line, row_lines = table_rows(columns)
+    yield header_line
+    yield from row_lines
+
+
+def truncate_line(line, max_width):
+    """Truncates the line to the given displayed width, keeping ANSI escape sequences intact"""
+    if visible_width(line) <= max_width:
+        return line
+    remaining = max_width - 1
+    parts = []
+    for part in __ANSI_ESCAPE_PATTERN.split(line):
+        if __ANSI_ESCAPE_PATTERN.fullmatch(part):
+            parts.append(part)
+            continue
+        for c in part:
+            width = __text_width(c)
+            if width > remaining:
+                remaining = 0
+                break
+            parts.append(c)
+            remaining -= width
+    return ''.join(parts) + '…'
+
+
+def print_table(columns, max_width=None):
+    """
+    Prints the table described by the (header, values) columns, one line at a time.
+    Lines wider than max_width, when provided, are truncated.
+    """
+    for line in table_lines(columns):
+        sys.stdout.write(f'{truncate_line(line, max_width) if max_width else line}\n')
+    sys.stdout.flush()
+
+
 def retrieve_num_instances(service):
     """Returns the total number of instances."""
     instance_counts = service["instance-counts"]
@@ -36,6 +130,39 @@ def format_instance_status(instance):
         return terminal.failed(status)
 
 
+def sort_token_services(services):
+    """Returns the given services sorted in descending order by last request time"""
+    return sorted(services, key=lambda s: s.get('last-request-time', None) or '', reverse=True)
+
+
+def token_service_columns(services, token_name, token_etag=None, show_index=False, column_names=[]):
+    """
+    :param services: list of services to be displayed as rows, in order
+    :param token_name: the token that the services belong to
+    :param token_etag: token_etag determines if a the service is current, will default to service['etag'] or None
+    :param show_index: shows index column (usually for future choice prompt)
+    :param column_names: column fields to be included in table
+    :return: the (header, values) columns of the table, one value per service
+    """
+    timestamp_formatter = TimestampFormatter()
+    all_columns = [('Index', lambda index, s: f'[{index + 1}]'),
+                   ('Service Id', lambda _, s: s['service-id']),
+                   ('Cluster', lambda _, s: s.get('cluster', None)),
+                   ('Run as user', lambda _, s: s['effective-parameters']['run-as-user']),
+                   ('Instances', lambda _, s: retrieve_num_instances(s)),
+                   ('CPUs', lambda _, s: s['effective-parameters']['cpus']),
+                   ('Memory', lambda _, s: format_mem_field(s['effective-parameters'])),
+                   ('Version', lambda _, s: s['effective-parameters']['version']),
+                   ('In-flight req.', lambda _, s: s['request-metrics']['outstanding']),
+                   ('Status', lambda _, s: format_status(s['status'])),
+                   ('Last request', lambda _, s: format_last_request_time(s, timestamp_formatter.format)),
+                   ('Current?', lambda _, s: format_using_current_token(s, token_etag or s.get('etag', None),
+                                                                        token_name))]
+    return [(key, [value_fn(index, s) for index, s in enumerate(services)])
+            for key, value_fn in all_columns
+            if key in column_names or show_index and key == 'Index']
+
+
 def tabulate_token_services(services, token_name, token_etag=None, show_index=False, summary_table=True,
                             column_names=[]):
     """
@@ -47,28 +174,12 @@ def tabulate_token_services(services, token_name, token_etag=None, show_index=Fa
     :param column_names: column fields to be included in table
     :return: tabular output string and sorted services list in descending order by last request time
     """
+    from tabulate import tabulate
     num_services = len(services)
     if num_services > 0:
-        services = sorted(services, key=lambda s: s.get('last-request-time', None) or '', reverse=True)
-        rows = [collections.OrderedDict([(key, data)
-                                         for key, data in
-                                         [('Index', f'[{index + 1}]'),
-                                          ('Service Id', s['service-id']),
-                                          ('Cluster', s.get('cluster', None)),
-                                          ('Run as user', s['effective-parameters']['run-as-user']),
-                                          ('Instances', retrieve_num_instances(s)),
-                                          ('CPUs', s['effective-parameters']['cpus']),
-                                          ('Memory', format_mem_field(s['effective-parameters'])),
-                                          ('Version', s['effective-parameters']['version']),
-                                          ('In-flight req.', s['request-metrics']['outstanding']),
-                                          ('Status', format_status(s['status'])),
-                                          ('Last request', format_last_request_time(s)),
-                                          ('Current?',
-                                           format_using_current_token(s, token_etag or s.get('etag', None),
-                                                                      token_name))]
-                                         if key in column_names or show_index and key == 'Index'])
-                for index, s in enumerate(services)]
-        service_table = tabulate(rows, headers='keys', tablefmt='plain')
+        services = sort_token_services(services)
+        columns = token_service_columns(services, token_name, token_etag, show_index, column_names)
+        service_table = '\n'.join(table_lines(columns)) if columns else ''
         if summary_table:
             num_failing_services = len([s for s in services if s['status'] == 'Failing'])
             num_instances = sum(retrieve_num_instances(s) for s in services)
@@ -87,39 +198,40 @@ def tabulate_token_services(services, token_name, token_etag=None, show_index=Fa
         return '', services
 
 
-def tabulate_service_instances(instances, show_index=False, column_names=[]):
+def service_instance_columns(instances, show_index=False, column_names=[]):
     """
-    :param instances: list of instances to be displayed
+    :param instances: list of instances to be displayed as rows, in order
     :param show_index: shows index column (usually for future choice prompt)
     :param column_names: column names to be displayed in table
-    :return: tabular output string
+    :return: the (header, values) columns of the table, one value per instance
     """
-    if len(instances) > 0:
-        rows = [collections.OrderedDict([(key, data)
-                                         for key, data in
-                                         [('Index', f'[{index + 1}]'),
-                                          ('Instance Id', inst['id']),
-                                          ('Host', inst['host']),
-                                          ('Status', format_instance_status(inst))]
-                                         if key in column_names or show_index and key == 'Index'])
-                for index, inst in enumerate(instances)]
-        return tabulate(rows, headers='keys', tablefmt='plain')
-    else:
-        return ''
+    all_columns = [('Index', lambda index, inst: f'[{index + 1}]'),
+                   ('Instance Id', lambda _, inst: inst['id']),
+                   ('Host', lambda _, inst: inst['host']),
+                   ('Status', lambda _, inst: format_instance_status(inst))]
+    return [(key, [value_fn(index, inst) for index, inst in enumerate(instances)])
+            for key, value_fn in all_columns
+            if key in column_names or show_index and key == 'Index']
 
 
-def get_user_selection(items, tabular_str, short_circuit_choice=True):
+def get_user_selection(items, columns, short_circuit_choice=True):
     """
     :param items: list of possible choices
-    :param tabular_str: table output to provide user with options
+    :param columns: the (header, values) columns of the table providing the user with options, one value per item
     :param short_circuit_choice: When True and only one item in items, return that item as the selection without user
     prompt.
     :exception Raises exception when user input is invalid
     :return selected item (an element from the items list)
+    On a terminal, the user picks the item from the table filtered as they type; otherwise, by entering its index.
     """
     if short_circuit_choice and len(items) == 1:
         return items[0]
-    print(tabular_str)
+    header_line, row_lines = table_rows(columns)
+    rows = list(row_lines)
+    from waiter import picker
+    if picker.is_available():
+        return picker.pick(items, [header_line], rows)
+    print('\n'.join([header_line, *rows]))
     answer = input(f'Enter the Index of your choice: ')
     print()
     try:
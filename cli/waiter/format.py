@@ -1,11 +1,14 @@
-import arrow
-import humanfriendly
+from datetime import datetime, timezone
 
 from waiter import terminal
 
+# arrow and humanfriendly are imported by the functions using them, as they are slow to import and most
+# commands never need them
+
 
 def format_memory_amount(mebibytes):
     """Formats an amount, in MiB, to be human-readable"""
+    import humanfriendly
     return humanfriendly.format_size(mebibytes * 1024 * 1024, binary=True)
 
 
@@ -16,9 +19,51 @@ def format_mem_field(job):
 
 def format_timestamp_string(s):
     """Formats the given timestamp string in the "time ago" format"""
+    import arrow
     return arrow.get(s).humanize()
 
 
+class TimestampFormatter:
+    """
+    Formats many timestamp strings in the "time ago" format, with the same output as format_timestamp_string
+    at the moment the formatter was created. Identical strings are formatted once, timestamps are parsed with
+    datetime.fromisoformat when possible, and timestamps less than a day away are bucketed by their distance
+    in whole seconds, which is all that humanize depends on in that range.
+    """
+
+    __SECS_PER_DAY = 24 * 60 * 60
+
+    def __init__(self):
+        self.__now = datetime.now(timezone.utc)
+        self.__by_string = {}
+        self.__by_delta_secs = {}
+
+    @staticmethod
+    def __parse(s):
+        """Parses the timestamp string, falling back to arrow's parser for formats datetime does not support"""
+        import arrow
+        try:
+            return arrow.Arrow.fromdatetime(datetime.fromisoformat(s))
+        except (AttributeError, ValueError):
+            # datetime.fromisoformat is only available from Python 3.7
+            return arrow.get(s)
+
+    def __humanize(self, s):
+        timestamp = self.__parse(s)
+        delta_secs = int(round((timestamp.datetime - self.__now).total_seconds()))
+        if abs(delta_secs) >= self.__SECS_PER_DAY:
+            return timestamp.humanize(self.__now)
+        if delta_secs not in self.__by_delta_secs:
+            self.__by_delta_secs[delta_secs] = timestamp.humanize(self.__now)
+        return self.__by_delta_secs[delta_secs]
+
+    def format(self, s):
+        """Formats the given timestamp string in the "time ago" format"""
+        if s not in self.__by_string:
+            self.__by_string[s] = self.__humanize(s)
+        return self.__by_string[s]
+
+
 def format_field_name(s):
     """Formats the given field name in a more readable format"""
     parts = s.split('-')
@@ -46,10 +91,10 @@ def format_status(status):
         return status
 
 
-def format_last_request_time(service):
-    """Formats the last request time of the given service"""
+def format_last_request_time(service, format_timestamp=format_timestamp_string):
+    """Formats the last request time of the given service, optionally using a TimestampFormatter's format"""
     if 'last-request-time' in service and service['last-request-time']:
-        last_request_time = format_timestamp_string(service['last-request-time'])
+        last_request_time = format_timestamp(service['last-request-time'])
     else:
         last_request_time = 'n/a'
     return last_request_time
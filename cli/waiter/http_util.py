@@ -1,12 +1,16 @@
+import codecs
 import importlib
 import json
 import logging
+import re
+import time
 import uuid
 from urllib.parse import urljoin
 
 import requests
 
 import waiter
+from waiter import metrics
 from waiter.util import print_error
 
 
@@ -14,6 +18,10 @@ session = None
 timeouts = None
 adapter_factory = None
 
+# The configuration the current session was created with; a process running several commands (e.g. the agent)
+# keeps the session, and with it the pooled connections to the clusters, as long as this doesn't change
+__session_key = None
+
 
 def set_retries(retries):
     """Sets the number of retries to use"""
@@ -27,10 +35,15 @@ def configure(config, plugins):
     global session
     global timeouts
     global adapter_factory
+    global __session_key
     adapter_factory = plugins.get('http-adapter-factory', requests.adapters.HTTPAdapter)
     session_factory = plugins.get('http-session-factory', requests.Session)
     logging.getLogger('urllib3').setLevel(logging.DEBUG) # logging.disable in cli.py may override
     http_config = config.get('http')
+    session_key = (json.dumps(http_config, sort_keys=True), adapter_factory, session_factory)
+    if session is not None and session_key == __session_key:
+        logging.debug('reusing the existing http session')
+        return
     connect_timeout = http_config.get('connect-timeout')
     read_timeout = http_config.get('read-timeout')
     timeouts = (connect_timeout, read_timeout)
@@ -49,6 +62,7 @@ def configure(config, plugins):
             logging.debug(f'using http basic auth with user {user}')
         else:
             raise Exception(f'Encountered unsupported authentication type "{auth_type}".')
+    __session_key = session_key
 
 
 def __post(url, json_body, params=None, **kwargs):
@@ -88,13 +102,36 @@ def default_http_headers():
     }
 
 
+def __measure(cluster, method, send_request, stream=False):
+    """
+    Sends a request using send_request and records its latency, status code and
+    response size (or its error) in the per-cluster request metrics; the size
+    of a streamed response is not recorded, since its body is read later
+    """
+    cluster_metric_name = f'cluster.{metrics.name_part(cluster["name"])}.request'
+    start_time = time.perf_counter()
+    try:
+        resp = send_request()
+    except Exception as e:
+        metrics.inc(f'{cluster_metric_name}.errors', cluster=cluster['name'], method=method, status=type(e).__name__)
+        raise
+    elapsed_millis = (time.perf_counter() - start_time) * 1000
+    tags = {'cluster': cluster['name'], 'method': method, 'status': resp.status_code}
+    metrics.timing(f'{cluster_metric_name}.latency', elapsed_millis, **tags)
+    metrics.inc(f'{cluster_metric_name}.status.{resp.status_code}', **tags)
+    if not stream:
+        metrics.histogram(f'{cluster_metric_name}.response-bytes', len(resp.content), **tags)
+    return resp
+
+
 def post(cluster, endpoint, json_body, params=None, headers=None):
     """POSTs data to cluster at /endpoint"""
     if headers is None:
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __post(url, json_body, params=params, headers={**default_headers, **headers})
+    resp = __measure(cluster, 'POST',
+                     lambda: __post(url, json_body, params=params, headers={**default_headers, **headers}))
     resp.headers.pop('Set-Cookie', None)
     logging.info(f'POST response: {resp.text} (headers: {resp.headers})')
     return resp
@@ -106,23 +143,109 @@ def get(cluster, endpoint, params=None, headers=None, read_timeout=None):
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __get(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout)
+    resp = __measure(cluster, 'GET',
+                     lambda: __get(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout))
     resp.headers.pop('Set-Cookie', None)
     logging.info(f'GET response: {resp.text} (headers: {resp.headers})')
     return resp
 
 
+def get_streaming(cluster, endpoint, params=None, headers=None, read_timeout=None):
+    """
+    GETs a streamed response from cluster at /endpoint; only the headers have been read when this returns,
+    and the caller must close the response once it has read what it needs from the body
+    """
+    if headers is None:
+        headers = {}
+    url = __make_url(cluster, endpoint)
+    default_headers = default_http_headers()
+    resp = __measure(cluster, 'GET',
+                     lambda: __get(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout,
+                                   stream=True),
+                     stream=True)
+    resp.headers.pop('Set-Cookie', None)
+    logging.info(f'GET response: streamed (headers: {resp.headers})')
+    return resp
+
+
 def delete(cluster, endpoint, params=None, headers=None, read_timeout=None):
     """DELETEs data corresponding to the given params on cluster at /endpoint"""
     if headers is None:
         headers = {}
     url = __make_url(cluster, endpoint)
     default_headers = default_http_headers()
-    resp = __delete(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout)
+    resp = __measure(cluster, 'DELETE',
+                     lambda: __delete(url, params, headers={**default_headers, **headers}, read_timeout=read_timeout))
     logging.info(f'DELETE response: {resp.text}')
     return resp
 
 
+class JsonValueEndFinder:
+    """
+    Finds the end of the first JSON object or array in text that is fed incrementally, by tracking the nesting
+    of brackets outside of strings, so that each piece of text is only scanned once
+    """
+    __STRUCTURE_PATTERN = re.compile(r'[{}\[\]"]')
+    __STRING_PATTERN = re.compile(r'["\\]')
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text):
+        """Returns the offset in text just after the end of the first value, or None if it hasn't ended yet"""
+        position = 0
+        if self.escaped and text:
+            self.escaped = False
+            position = 1
+        while True:
+            if self.in_string:
+                match = self.__STRING_PATTERN.search(text, position)
+                if match is None:
+                    return None
+                if match.group() == '\\':
+                    if match.end() == len(text):
+                        self.escaped = True
+                        return None
+                    position = match.end() + 1
+                    continue
+                self.in_string = False
+            else:
+                match = self.__STRUCTURE_PATTERN.search(text, position)
+                if match is None:
+                    return None
+                character = match.group()
+                if character == '"':
+                    self.in_string = True
+                elif character in '{[':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return match.end()
+            position = match.end()
+
+
+def read_first_json_value(resp):
+    """
+    Reads the given streamed response until its body holds a complete JSON value and returns that value,
+    without waiting for the rest of the stream; the body is decoded incrementally and parsed only once
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    end_finder = JsonValueEndFinder()
+    texts = []
+    for chunk in resp.iter_content(chunk_size=None):
+        text = decoder.decode(chunk)
+        texts.append(text)
+        end = end_finder.feed(text)
+        if end is not None:
+            texts[-1] = text[:end]
+            return json.loads(''.join(texts))
+    texts.append(decoder.decode(b'', final=True))
+    return json.loads(''.join(texts))
+
+
 def make_data_request(cluster, make_request_fn):
     """
     Makes a request (using make_request_fn), parsing the
@@ -0,0 +1,52 @@
+import logging
+import time
+
+from waiter.util import cache_file_path, load_json_file, write_json_file_atomically
+
+# Name of the file caching the instances recently resolved by ssh, keyed by instance id
+INSTANCE_CACHE_FILE_NAME = 'instance-cache.json'
+
+# How long a cached instance is used before it is resolved again, short enough that an instance which has
+# since been moved or killed is not used for long
+TTL_SECS = 60
+
+# Maximum number of instances kept in the cache
+MAX_INSTANCES = 500
+
+# The instance fields needed to reach an instance, which are the only ones cached
+CACHED_FIELDS = ['id', 'service-id', 'host', 'log-directory',
+                 'k8s/api-server-url', 'k8s/context', 'k8s/namespace', 'k8s/pod-name']
+
+
+def __load(now):
+    """Returns the cached instances that have not expired, keyed by instance id"""
+    instances = load_json_file(cache_file_path(INSTANCE_CACHE_FILE_NAME)) or {}
+    return {instance_id: entry for instance_id, entry in instances.items()
+            if now - entry.get('cached-at', 0) < TTL_SECS}
+
+
+def get_instance(clusters, instance_id):
+    """Returns the cached instance with the given id if it was resolved on one of the given clusters, or None"""
+    entry = __load(time.time()).get(instance_id)
+    if entry is None or entry['cluster-url'] not in [c['url'] for c in clusters]:
+        return None
+    logging.debug(f'using cached instance {instance_id} of {entry["cluster-url"]}')
+    return entry['instance']
+
+
+def put_instances(cluster, instances):
+    """Caches the given instances of the given cluster, dropping the expired and least recently cached ones"""
+    if not instances:
+        return
+    now = time.time()
+    try:
+        cached_instances = __load(now)
+        for instance in instances:
+            cached_instances[instance['id']] = {'cached-at': now,
+                                                'cluster-url': cluster['url'],
+                                                'instance': {k: instance[k] for k in CACHED_FIELDS if k in instance}}
+        latest_ids = sorted(cached_instances, key=lambda i: cached_instances[i]['cached-at'])[-MAX_INSTANCES:]
+        write_json_file_atomically(cache_file_path(INSTANCE_CACHE_FILE_NAME),
+                                   {i: cached_instances[i] for i in latest_ids})
+    except OSError:
+        logging.exception('unable to cache instances')
@@ -1,84 +1,289 @@
 import logging
+import re
 import socket
+import threading
 
-from waiter.util import current_user
+from waiter import spool
+from waiter.util import cache_file_path, current_user
+
+# How often the background flusher sends the buffered metrics while a command is running
+FLUSH_INTERVAL_SECS = 1
+
+# Maximum size of a UDP datagram holding metric lines, small enough to avoid fragmentation
+MAX_DATAGRAM_BYTES = 1432
+
+# Name of the spool file holding the metric lines that could not be sent, until the sink is available again
+SPOOL_FILE_NAME = 'metrics-spool.txt'
+
+# Number of spooled metric lines sent at once when draining the spool
+DRAIN_BATCH_LINES = 500
 
 __line_formats = None
-__conn = None
 __host = socket.gethostname()
 __user = current_user()
 __disabled = True
 
+# Where and how metrics are sent: the protocol ('tcp' or 'udp'), the address, and the connect timeout and retries
+__sink = None
+
+# The TCP connection (or UDP socket) to the sink, and the sink it was opened for, only used by the flusher
+__conn = None
+__conn_sink = None
+
+# Metric lines waiting to be sent by the flusher, the lines it is sending, along with the number of lines
+# queued and handled (i.e. sent, spooled or dropped) so far, guarded by __condition
+__buffer = []
+__in_flight = None
+__queued_count = 0
+__handled_count = 0
+__condition = threading.Condition()
+__flush_requested = threading.Event()
+__flusher = None
+
 
 def initialize(config):
     """
     Initializes the metrics module using the given
     config; note that metrics can be completely
-    disabled in which case this is essentially a no-op
+    disabled in which case this is essentially a no-op.
+    Nothing is sent here: metrics are buffered and sent by
+    a background flusher, so the sink never delays commands.
     """
     global __disabled
+    global __flusher
+    global __line_formats
+    global __sink
     try:
         metrics_config = config.get('metrics')
         __disabled = metrics_config.get('disabled')
         if __disabled:
             return
 
-        global __conn
-        global __line_formats
         __line_formats = metrics_config.get('line-formats')
-        __conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        __conn.settimeout(metrics_config.get('timeout'))
-        address = (metrics_config.get('host'), metrics_config.get('port'))
-        for attempt in range(metrics_config.get('max-retries') + 1):
-            try:
-                logging.info(f'connecting to {address} for metrics (attempt = {attempt})...')
-                __conn.connect(address)
-                logging.info(f'...connected')
-                break
-            except TimeoutError:
-                logging.exception(f'timeout attempting to connect to {address}')
-        else:
-            __disabled = True
-            logging.error(f'unable to connect to {address} for metrics, giving up')
+        protocol = metrics_config.get('protocol', 'tcp').lower()
+        if protocol not in ['tcp', 'udp']:
+            raise Exception(f'Encountered unsupported metrics protocol "{protocol}".')
+        __sink = {'address': (metrics_config.get('host'), metrics_config.get('port')),
+                  'flush-timeout': metrics_config.get('flush-timeout'),
+                  'max-retries': metrics_config.get('max-retries'),
+                  'protocol': protocol,
+                  'spool-max-bytes': metrics_config.get('spool-max-bytes'),
+                  'timeout': metrics_config.get('timeout')}
+        with __condition:
+            if __flusher is None:
+                __flusher = threading.Thread(target=__flush_loop, name='metrics-flusher', daemon=True)
+                __flusher.start()
+        __flush_requested.set()
     except:
         __disabled = True
         logging.exception('exception when initializing metrics')
 
 
 def close():
-    """Closes the metrics module (unless disabled)"""
-    global __disabled
+    """
+    Flushes the buffered metrics (unless disabled), waiting at most for the configured flush-timeout;
+    metrics that the flusher has not sent in time, including those it is still sending (e.g. while it
+    waits to connect), are spooled instead
+    """
+    global __buffer
+    global __handled_count
+    global __in_flight
     if __disabled:
         return
+    with __condition:
+        target_count = __queued_count
+        __flush_requested.set()
+        flushed = __condition.wait_for(lambda: __handled_count >= target_count, __sink['flush-timeout'])
+        if not flushed:
+            lines = (__in_flight or []) + __buffer
+            __buffer, __in_flight = [], None
+            __handled_count += len(lines)
+    if not flushed:
+        logging.warning(f'unable to flush {len(lines)} metric(s) in time')
+        __spool_lines(lines)
+
+
+def __spool_lines(lines):
+    """Appends the given metric lines to the spool, unless spooling is disabled, or drops them"""
+    max_bytes = __sink['spool-max-bytes']
+    if not lines:
+        return
+    if not max_bytes:
+        logging.warning(f'dropped {len(lines)} metric(s)')
+        return
     try:
+        spool.append(cache_file_path(SPOOL_FILE_NAME), lines, max_bytes)
+        logging.info(f'spooled {len(lines)} metric(s)')
+    except OSError:
+        logging.exception(f'unable to spool {len(lines)} metric(s)')
+
+
+def __drain_spool(sink):
+    """Sends the spooled metric lines in batches, spooling the unsent ones again if the sink becomes unavailable"""
+    spool_path = cache_file_path(SPOOL_FILE_NAME)
+    while not spool.is_empty(spool_path):
+        lines = spool.take(spool_path)
+        if lines is None:
+            return
+        try:
+            for start in range(0, len(lines), DRAIN_BATCH_LINES):
+                if not __send_lines(sink, lines[start:start + DRAIN_BATCH_LINES]):
+                    __spool_lines(lines[start:])
+                    return
+            logging.info(f'drained {len(lines)} spooled metric(s)')
+        finally:
+            spool.done(spool_path)
+
+
+def __connect(sink):
+    """Returns a socket for sending metrics to the given sink, or None if the sink cannot be reached"""
+    address = sink['address']
+    if sink['protocol'] == 'udp':
+        try:
+            # resolve the host once, rather than for every datagram
+            family, sock_type, proto, _, sock_address = socket.getaddrinfo(*address, type=socket.SOCK_DGRAM)[0]
+            conn = socket.socket(family, sock_type, proto)
+            conn.connect(sock_address)
+            return conn
+        except OSError:
+            logging.exception(f'unable to connect to {address} for metrics')
+            return None
+    for attempt in range(sink['max-retries'] + 1):
+        try:
+            logging.info(f'connecting to {address} for metrics (attempt = {attempt})...')
+            conn = socket.create_connection(address, timeout=sink['timeout'])
+            logging.info(f'...connected')
+            return conn
+        except OSError:
+            logging.exception(f'unable to connect to {address} for metrics')
+    logging.error(f'unable to connect to {address} for metrics, giving up')
+    return None
+
+
+def __send_lines(sink, lines):
+    """Sends the given metric lines to the sink, (re)connecting if needed; returns true if they were sent"""
+    global __conn
+    global __conn_sink
+    if __conn is None or __conn_sink != sink:
+        if __conn is not None:
+            __conn.close()
+        __conn = __connect(sink)
+        __conn_sink = sink
+        if __conn is None:
+            return False
+    if not lines:
+        return True
+    try:
+        if sink['protocol'] == 'udp':
+            datagram, datagram_size = [], 0
+            for line in (l.encode() for l in lines):
+                if datagram and datagram_size + len(line) > MAX_DATAGRAM_BYTES:
+                    __conn.send(b'\n'.join(datagram))
+                    datagram, datagram_size = [], 0
+                datagram.append(line)
+                datagram_size += len(line) + 1
+            __conn.send(b'\n'.join(datagram))
+        else:
+            __conn.sendall(''.join(f'{line}\n' for line in lines).encode())
+        logging.info(f'sent {len(lines)} metric(s)')
+        return True
+    except OSError:
+        logging.exception(f'exception when sending {len(lines)} metric(s)')
         __conn.close()
-    except:
-        __disabled = True
-        logging.exception('exception when closing metrics socket')
+        __conn = None
+        return False
 
 
-def __send(metric):
-    """Sends the given metric using the configured line format"""
-    global __disabled
+def __flush():
+    """
+    Sends all buffered metric lines, which are spooled if the sink is unavailable,
+    and drains the spool once the sink is available
+    """
+    global __buffer
+    global __handled_count
+    global __in_flight
+    sink = __sink
+    with __condition:
+        lines, __buffer = __buffer, []
+        __in_flight = lines
     try:
-        line_format = __line_formats[metric['type']]
+        # without any lines, this (re)connects ahead of time
+        sent = __send_lines(sink, lines)
+        # unless close() has spooled them in the meantime, as it gave up waiting for them
+        if not sent and __in_flight is lines:
+            __spool_lines(lines)
+    finally:
+        with __condition:
+            if __in_flight is lines:
+                __in_flight = None
+                __handled_count += len(lines)
+            __condition.notify_all()
+    if sent:
+        __drain_spool(sink)
+
+
+def __flush_loop():
+    """Periodically, or when a flush is requested, sends the buffered metrics"""
+    while True:
+        __flush_requested.wait(FLUSH_INTERVAL_SECS)
+        __flush_requested.clear()
+        try:
+            __flush()
+        except:
+            logging.exception('exception when flushing metrics')
+
+
+def __enqueue(metric):
+    """
+    Formats the given metric using the configured line format and buffers it for the flusher;
+    metrics of types without a configured line format are not sent
+    """
+    global __queued_count
+    try:
+        line_format = __line_formats.get(metric['type'])
+        if line_format is None:
+            return
         metric_line = line_format.format(**metric)
-        logging.info('sending metric %s' % metric_line)
-        __conn.send(('%s\n' % metric_line).encode())
-        logging.info('metric send completed')
+        logging.info('buffering metric %s' % metric_line)
+        with __condition:
+            __buffer.append(metric_line)
+            __queued_count += 1
     except:
-        __disabled = True
-        logging.exception('exception when sending metric %s' % metric)
+        logging.exception('exception when buffering metric %s' % metric)
 
 
-def inc(metric_name, count=1):
-    """Increments a counter with the given metric_name by count"""
+def __record(metric_type, metric_name, value, tags):
+    """
+    Records a metric of the given type; the tags are additional fields
+    (e.g. the cluster) that the line format of the type can refer to
+    """
     if __disabled:
         return
-    metric = {'namespace': 'waitercli',
+    metric = {**tags,
+              'namespace': 'waitercli',
               'name': metric_name,
-              'value': count,
+              'value': value,
               'host': __host,
               'user': __user,
-              'type': 'count'}
-    __send(metric)
+              'type': metric_type}
+    __enqueue(metric)
+
+
+def name_part(s):
+    """Returns the given string (e.g. a cluster name) as a part of a metric name, without any separator"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(s))
+
+
+def inc(metric_name, count=1, **tags):
+    """Increments a counter with the given metric_name by count"""
+    __record('count', metric_name, count, tags)
+
+
+def timing(metric_name, millis, **tags):
+    """Records a duration in milliseconds, sent using the "timer" line format"""
+    __record('timer', metric_name, round(millis, 3), tags)
+
+
+def histogram(metric_name, value, **tags):
+    """Records a sample of a distribution (e.g. a size), sent using the "histogram" line format"""
+    __record('histogram', metric_name, value, tags)
@@ -0,0 +1,164 @@
+import json
+import logging
+import mmap
+import os
+import subprocess
+import sys
+import time
+
+from waiter.util import cache_file_path, current_user, write_file_atomically, write_json_file_atomically
+
+# Name of the index file holding the sorted token names owned by a user, one per line
+TOKENS_INDEX_FILE_NAME = 'completion-tokens-%s.txt'
+
+# Name of the index file holding the sorted recently seen service ids, one per line
+SERVICES_INDEX_FILE_NAME = 'completion-services.txt'
+
+# Name of the file holding the time at which each recently seen service id was last seen
+SERVICES_SEEN_FILE_NAME = 'completion-services.json'
+
+# Maximum number of recently seen service ids kept in the index
+MAX_SERVICE_IDS = 2000
+
+# Name of the file marking that completion is enabled, created when the completion script is printed for a shell
+ENABLED_FILE_NAME = 'completion-enabled'
+
+# Default interval at which the token names are refreshed once completion is enabled
+DEFAULT_REFRESH_INTERVAL_SECS = 900
+
+
+def tokens_index_path(owner=None):
+    """Returns the path of the token names index of the given owner (the current user by default)"""
+    return cache_file_path(TOKENS_INDEX_FILE_NAME % (owner or current_user()))
+
+
+def services_index_path():
+    """Returns the path of the recently seen service ids index"""
+    return cache_file_path(SERVICES_INDEX_FILE_NAME)
+
+
+def write_names(path, names):
+    """Writes the given names, sorted and without duplicates, to a temporary file which then replaces the index"""
+    write_file_atomically(path, lambda index_file: index_file.writelines(f'{name}\n' for name in sorted(set(names))))
+
+
+def query_names(path, prefix):
+    """
+    Returns the names in the index at the given path that start with prefix. The index is memory-mapped and
+    binary searched for the first name not less than prefix, so only the matching lines are ever read.
+    """
+    try:
+        with open(path, 'rb') as index_file:
+            if os.fstat(index_file.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                return __query_mapped_names(index, prefix.encode())
+    except OSError:
+        return []
+
+
+def __query_mapped_names(index, prefix):
+    """Returns the names in the memory-mapped index that start with the given (encoded) prefix"""
+    low, high = 0, len(index)
+    while low < high:
+        middle = (low + high) // 2
+        line_start = index.rfind(b'\n', 0, middle) + 1
+        line_end = index.find(b'\n', middle)
+        line_end = len(index) if line_end < 0 else line_end
+        if index[line_start:line_end] < prefix:
+            low = line_end + 1
+        else:
+            high = line_start
+    matches = []
+    while low < len(index):
+        line_end = index.find(b'\n', low)
+        line_end = len(index) if line_end < 0 else line_end
+        name = index[low:line_end]
+        if not name.startswith(prefix):
+            break
+        matches.append(name.decode())
+        low = line_end + 1
+    return matches
+
+
+def enable():
+    """Marks completion as enabled, so that commands maintain the index from then on"""
+    with open(cache_file_path(ENABLED_FILE_NAME), 'a'):
+        pass
+
+
+def is_enabled():
+    """Returns true if completion has been enabled, i.e. its script has been printed for a shell"""
+    return os.path.exists(cache_file_path(ENABLED_FILE_NAME))
+
+
+def refresh_tokens(clusters, owner=None):
+    """Re-indexes the names of the tokens owned by the given owner (the current user by default) across clusters"""
+    from waiter.querying import query_tokens
+    owner = owner or current_user()
+    query_result = query_tokens(clusters, owner)
+    token_names = [token['token'] for data in query_result['clusters'].values() for token in data['tokens']]
+    write_names(tokens_index_path(owner), token_names)
+    return len(set(token_names))
+
+
+def record_service_ids(service_ids):
+    """Adds the given service ids to the recently seen service ids index, evicting the least recently seen ones"""
+    seen_path = cache_file_path(SERVICES_SEEN_FILE_NAME)
+    try:
+        with open(seen_path) as seen_file:
+            last_seen = json.load(seen_file)
+    except (OSError, ValueError):
+        last_seen = {}
+    now = int(time.time())
+    for service_id in service_ids:
+        last_seen[service_id] = now
+    if len(last_seen) > MAX_SERVICE_IDS:
+        recent_ids = sorted(last_seen, key=last_seen.get, reverse=True)[:MAX_SERVICE_IDS]
+        last_seen = {service_id: last_seen[service_id] for service_id in recent_ids}
+    write_json_file_atomically(seen_path, last_seen)
+    write_names(services_index_path(), last_seen.keys())
+
+
+def is_tokens_index_stale(refresh_interval_secs):
+    """Returns true if the current user's token names index is missing or older than the given interval"""
+    try:
+        return time.time() - os.path.getmtime(tokens_index_path()) > refresh_interval_secs
+    except OSError:
+        return True
+
+
+def refresh_tokens_in_background(config_path):
+    """
+    Starts a detached "waiter completion refresh" process, so that the index is refreshed without making the
+    current command wait. The index is touched first, so that concurrent commands don't start a refresh too.
+    """
+    index_path = tokens_index_path()
+    with open(index_path, 'a'):
+        os.utime(index_path)
+    command = [sys.executable, sys.argv[0]]
+    if config_path:
+        command.extend(['--config', config_path])
+    command.extend(['completion', 'refresh'])
+    logging.debug(f'refreshing the name index in the background: {command}')
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def update_after_command(config_map, config_path, action, seen_service_ids):
+    """
+    Maintains the name index after a command, once completion is enabled (or its refresh interval is configured):
+    records the service ids it has seen and, unless the interval is 0, refreshes stale token names in the background
+    """
+    try:
+        refresh_interval_secs = config_map.get('completion', {}).get('refresh-interval-secs')
+        if not (refresh_interval_secs or is_enabled()):
+            return
+        if refresh_interval_secs is None:
+            refresh_interval_secs = DEFAULT_REFRESH_INTERVAL_SECS
+        if seen_service_ids:
+            record_service_ids(seen_service_ids)
+        if action != 'completion' and refresh_interval_secs and is_tokens_index_stale(refresh_interval_secs):
+            refresh_tokens_in_background(config_path)
+    except Exception:
+        logging.exception('unable to update the name index')
@@ -0,0 +1,186 @@
+import os
+import shutil
+import sys
+
+from waiter.display import strip_ansi, truncate_line
+
+# Terminal control sequences used to redraw the picker in place
+CLEAR_LINE = '\033[K'
+CLEAR_BELOW = '\033[J'
+REVERSE = '\033[7m'
+RESET = '\033[0m'
+
+# Maximum number of candidates shown at once
+MAX_VISIBLE_ROWS = 20
+
+# Keys, as read from the terminal in cbreak mode
+KEY_UP = ['\033[A', '\033OA', '\x10']  # arrow up, or ctrl-p
+KEY_DOWN = ['\033[B', '\033OB', '\x0e']  # arrow down, or ctrl-n
+KEY_ENTER = ['\r', '\n']
+KEY_BACKSPACE = ['\x7f', '\x08']
+KEY_CLEAR = '\x15'  # ctrl-u
+KEY_ESCAPE = '\033'
+
+
+def is_available():
+    """Returns true if the user can interact with the picker, i.e. both stdin and stdout are terminals"""
+    if not (sys.stdin.isatty() and sys.stdout.isatty()):
+        return False
+    try:
+        import termios
+        termios.tcgetattr(sys.stdin.fileno())
+    except Exception:
+        return False
+    return True
+
+
+def fuzzy_score(query, text):
+    """
+    Returns the score of the given (lowercase) text for the query, lower being a better match, or None if the
+    characters of the query do not all appear in the text, in order. Texts containing the query as is come first,
+    then the texts in which the matched characters span the fewest characters.
+    """
+    position = text.find(query)
+    if position >= 0:
+        return 0, position
+    start = end = text.find(query[0])
+    if start < 0:
+        return None
+    for c in query[1:]:
+        end = text.find(c, end + 1)
+        if end < 0:
+            return None
+    return 1, end - start
+
+
+class SearchIndex:
+    """
+    The lowercase searchable texts of the candidates, along with the matches of the recent queries: as the user
+    types, each query extends the previous one, so only the previous matches have to be searched again
+    """
+
+    def __init__(self, rows):
+        self.texts = [strip_ansi(row).lower() for row in rows]
+        self.matches = {'': list(range(len(rows)))}
+
+    def search(self, query):
+        """Returns the indices of the candidates matching the query, best matches first"""
+        query = query.lower()
+        if query not in self.matches:
+            prefix = next(query[:n] for n in range(len(query) - 1, -1, -1) if query[:n] in self.matches)
+            scored = [(score, index)
+                      for score, index in ((fuzzy_score(query, self.texts[i]), i) for i in self.matches[prefix])
+                      if score is not None]
+            self.matches[query] = [index for _, index in sorted(scored)]
+        return self.matches[query]
+
+
+class Picker:
+    """Lets the user choose one of the rows of a table, filtering the rows incrementally as they type"""
+
+    def __init__(self, header_lines, rows):
+        self.header_lines = header_lines
+        self.rows = rows
+        self.index = SearchIndex(rows)
+        self.query = ''
+        self.matches = self.index.search('')
+        self.selected = 0
+        self.first_visible = 0
+        self.drawn_lines = 0
+
+    def frame(self):
+        """Returns the lines of the picker for the current query and selection, the filter prompt being the last"""
+        columns, lines = shutil.get_terminal_size()
+        # a line as wide as the terminal would wrap on some terminals, breaking the redraw
+        columns -= 1
+        visible_rows = max(1, min(MAX_VISIBLE_ROWS, lines - len(self.header_lines) - 2))
+        if self.selected < self.first_visible:
+            self.first_visible = self.selected
+        elif self.selected >= self.first_visible + visible_rows:
+            self.first_visible = self.selected - visible_rows + 1
+        frame = [truncate_line(line, columns) for line in self.header_lines]
+        for position in range(self.first_visible, min(len(self.matches), self.first_visible + visible_rows)):
+            row = self.rows[self.matches[position]]
+            if position == self.selected:
+                frame.append(f'{REVERSE}{truncate_line(strip_ansi(row), columns)}{RESET}')
+            else:
+                frame.append(truncate_line(row, columns))
+        frame.append(truncate_line(f'({len(self.matches)}/{len(self.rows)}) Filter: {self.query}', columns))
+        return frame
+
+    def draw(self, lines):
+        """Replaces the previously drawn lines with the given ones, in a single write"""
+        move_up = f'\033[{self.drawn_lines - 1}F' if self.drawn_lines > 1 else '\r'
+        sys.stdout.write(move_up + f'{CLEAR_LINE}\n'.join(lines) + CLEAR_LINE + CLEAR_BELOW)
+        sys.stdout.flush()
+        self.drawn_lines = len(lines)
+
+    def handle_key(self, key):
+        """Updates the query or selection for the given key; returns true once the selection has been made"""
+        if key in KEY_ENTER:
+            if self.matches:
+                return True
+            sys.stdout.write('\a')
+        elif key in KEY_UP:
+            self.selected = max(0, self.selected - 1)
+        elif key in KEY_DOWN:
+            self.selected = min(len(self.matches) - 1, self.selected + 1)
+        elif key == KEY_ESCAPE:
+            raise Exception('No choice was made.')
+        else:
+            if key in KEY_BACKSPACE:
+                self.query = self.query[:-1]
+            elif key == KEY_CLEAR:
+                self.query = ''
+            elif key.isprintable():
+                self.query += key
+            else:
+                return False
+            self.matches = self.index.search(self.query)
+            self.selected = 0
+        return False
+
+    def pick(self):
+        """Returns the index of the row chosen by the user"""
+        import termios
+        import tty
+        fd = sys.stdin.fileno()
+        saved_attributes = termios.tcgetattr(fd)
+        try:
+            # cbreak mode delivers each key as it is typed, while ctrl-c still interrupts
+            tty.setcbreak(fd)
+            self.draw(self.frame())
+            while True:
+                for key in split_keys(os.read(fd, 64).decode(errors='ignore')):
+                    if self.handle_key(key):
+                        chosen = self.matches[self.selected]
+                        self.draw(self.header_lines + [self.rows[chosen]])
+                        sys.stdout.write('\n')
+                        return chosen
+                self.draw(self.frame())
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved_attributes)
+
+
+def split_keys(data):
+    """Splits the characters read from the terminal into keys, an escape sequence (e.g. an arrow) being one key"""
+    keys = []
+    i = 0
+    while i < len(data):
+        if data[i] == KEY_ESCAPE and i + 2 < len(data) and data[i + 1] in ['[', 'O']:
+            keys.append(data[i:i + 3])
+            i += 3
+        else:
+            keys.append(data[i])
+            i += 1
+    return keys
+
+
+def pick(items, header_lines, rows):
+    """
+    Lets the user choose one of the items, each shown as its row (rows[i] being the row of items[i]) below
+    the header lines, and returns the chosen item
+    """
+    if len(rows) != len(items):
+        raise Exception(f'Expected one row per item, got {len(rows)} rows for {len(items)} items.')
+    return items[Picker(header_lines, rows).pick()]
@@ -10,3 +10,8 @@ def configure(plugins):
 def get_fn(plugin_name, default_fn):
     """Returns the plugin function corresponding to the given plugin name if found, otherwise, default_fn"""
     return __plugins.get(plugin_name, default_fn)
+
+
+def get_plugins():
+    """Returns the configured plugins map"""
+    return __plugins
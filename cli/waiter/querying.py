@@ -3,7 +3,16 @@ import logging
 import os
 from concurrent import futures
 
-from waiter import http_util, terminal
+from waiter import http_util, metrics, terminal
+
+# Server-side configured cluster names, keyed by cluster url
+__cluster_config_names = {}
+
+# Ids of the services retrieved by the current command, which are added to the name index used for shell completion
+__seen_service_ids = set()
+
+# Token fields that are maintained by Waiter itself and must not be posted back
+SYSTEM_METADATA_KEYS = ['cluster', 'deleted', 'last-update-time', 'last-update-user', 'previous', 'root']
 
 
 def query_across_clusters(clusters, query_fn):
@@ -12,6 +21,7 @@ def query_across_clusters(clusters, query_fn):
     all_entities = {'clusters': {}}
     max_workers = os.cpu_count()
     logging.debug('querying with max workers = %s' % max_workers)
+    metrics.histogram('query.fan-out', len(clusters))
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_cluster = {query_fn(c, executor): c for c in clusters}
         for future, cluster in future_to_cluster.items():
@@ -24,6 +34,20 @@ def query_across_clusters(clusters, query_fn):
     return all_entities
 
 
+def query_across_clusters_as_completed(clusters, query_fn):
+    """
+    Like query_across_clusters, but yields a (cluster_name, entities) pair for every cluster as soon as
+    its query completes, so results can be processed while slower clusters are still being queried.
+    """
+    max_workers = os.cpu_count()
+    logging.debug('querying with max workers = %s' % max_workers)
+    metrics.histogram('query.fan-out', len(clusters))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_cluster = {query_fn(c, executor): c for c in clusters}
+        for future in concurrent.futures.as_completed(future_to_cluster):
+            yield future_to_cluster[future]['name'], future.result()
+
+
 def get_token(cluster, token_name, include=None):
     """Gets the token with the given name from the given cluster"""
     params = {'token': token_name}
@@ -75,16 +99,18 @@ def get_token_on_cluster(cluster, token_name, include_services=False, include_de
         return {'count': 0}
 
 
-def query_token(clusters, token, include_services=False, include_deleted=False):
+def query_token(clusters, token, include_services=False, include_deleted=False, as_completed=False):
     """
     Uses query_across_clusters to make the token
-    requests in parallel across the given clusters
+    requests in parallel across the given clusters.
+    With as_completed, uses query_across_clusters_as_completed instead.
     """
 
     def submit(cluster, executor):
         return executor.submit(get_token_on_cluster, cluster, token, include_services, include_deleted)
 
-    return query_across_clusters(clusters, submit)
+    query_fn = query_across_clusters_as_completed if as_completed else query_across_clusters
+    return query_fn(clusters, submit)
 
 
 def get_service(cluster, service_id):
@@ -92,6 +118,8 @@ def get_service(cluster, service_id):
     params = {'effective-parameters': True}
     endpoint = f'/apps/{service_id}'
     service, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, endpoint, params=params))
+    if service:
+        __seen_service_ids.add(service_id)
     return service
 
 
@@ -109,6 +137,8 @@ def get_services_using_token(cluster, token_name):
     params = {'effective-parameters': 'true',
               'token': token_name}
     services, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, 'apps', params=params))
+    if services:
+        __seen_service_ids.update(s['service-id'] for s in services)
     return services
 
 
@@ -131,6 +161,56 @@ def query_service(clusters, service_id):
         lambda cluster, executor: executor.submit(get_service_on_cluster, cluster, service_id))
 
 
+def get_healthy_instances(cluster, service_id):
+    """
+    Retrieves the healthy instances of the given service from the cluster's instance list, which only
+    supports watching: the current instances are streamed as the initial event, followed by changes,
+    so only the initial event is read. Returns None if the instances could not be retrieved.
+    """
+    params = {'service-id': service_id, 'watch': 'true'}
+    try:
+        with http_util.get_streaming(cluster, 'apps/instances', params=params) as resp:
+            if resp.status_code != 200:
+                logging.warning(f'Unexpected response code {resp.status_code} when listing instances. '
+                                f'Response body: {resp.text}')
+                return None
+            event = http_util.read_first_json_value(resp)
+    except Exception:
+        logging.exception(f'unable to list the instances on {cluster["name"]}')
+        return None
+    instances = event.get('object', {}).get('healthy-instances', {}).get('updated', [])
+    if instances:
+        __seen_service_ids.add(service_id)
+    return instances
+
+
+def get_healthy_instances_on_cluster(cluster, service_id):
+    """Gets the healthy instances of the service with the given service id on the given cluster"""
+    instances = get_healthy_instances(cluster, service_id)
+    if instances:
+        return {'count': len(instances), 'instances': instances}
+    else:
+        return {'count': 0}
+
+
+def query_healthy_instances(clusters, service_id):
+    """
+    Uses query_across_clusters to make the instance list
+    requests in parallel across the given clusters
+    """
+    return query_across_clusters(
+        clusters,
+        lambda cluster, executor: executor.submit(get_healthy_instances_on_cluster, cluster, service_id))
+
+
+def get_log_directory_entries(cluster, service_id, instance):
+    """Retrieves the entries (files and directories) of the log directory of the given instance of the service"""
+    params = {'host': instance['host'], 'instance-id': instance['id']}
+    endpoint = f'/apps/{service_id}/logs'
+    entries, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, endpoint, params=params))
+    return entries or []
+
+
 def query_services(clusters, token_name):
     """
     Uses query_across_clusters to make the service
@@ -159,20 +239,75 @@ def get_tokens_on_cluster(cluster, user):
         return {'count': 0}
 
 
-def query_tokens(clusters, user):
+def query_tokens(clusters, user, as_completed=False):
     """
     Uses query_across_clusters to make the token
-    requests in parallel across the given clusters
+    requests in parallel across the given clusters.
+    With as_completed, uses query_across_clusters_as_completed instead.
     """
-    return query_across_clusters(
+    query_fn = query_across_clusters_as_completed if as_completed else query_across_clusters
+    return query_fn(
         clusters,
         lambda cluster, executor: executor.submit(get_tokens_on_cluster, cluster, user))
 
 
+def pop_seen_service_ids():
+    """Returns the ids of the services retrieved since the previous call, and forgets them"""
+    service_ids = set(__seen_service_ids)
+    __seen_service_ids.difference_update(service_ids)
+    return service_ids
+
+
+def get_cluster_config_name(cluster):
+    """Returns the server-side configured name of the given cluster, fetching it from /settings at most once"""
+    cluster_url = cluster['url']
+    if cluster_url not in __cluster_config_names:
+        cluster_settings, _ = http_util.make_data_request(cluster, lambda: http_util.get(cluster, '/settings'))
+        __cluster_config_names[cluster_url] = cluster_settings['cluster-config']['name']
+    return __cluster_config_names[cluster_url]
+
+
+def get_token_snapshot_on_cluster(cluster, token_name, include_cluster_name):
+    """Gets the token (including deleted tokens) and its etag, and optionally the configured name, of the cluster"""
+    data = get_token_on_cluster(cluster, token_name, include_deleted=True)
+    if include_cluster_name:
+        try:
+            get_cluster_config_name(cluster)
+        except Exception:
+            logging.exception(f'Unable to retrieve the configured name of {cluster["name"]} ({cluster["url"]}).')
+    return data
+
+
+def query_token_snapshot(clusters, token_name):
+    """
+    Uses query_across_clusters to fetch, in parallel and exactly once per cluster,
+    the token description, its etag and (with multiple clusters) the cluster identity.
+    The result is a query_token result that includes deleted token descriptions.
+    """
+    include_cluster_names = len(clusters) > 1
+
+    def submit(cluster, executor):
+        return executor.submit(get_token_snapshot_on_cluster, cluster, token_name, include_cluster_names)
+
+    return query_across_clusters(clusters, submit)
+
+
+def get_existing_token_from_snapshot(query_result, cluster):
+    """
+    Returns the (token_data, etag) pair of the live token on the given cluster from a query_token_snapshot
+    result, with Waiter-maintained metadata removed; returns (None, None) if there is no live token there
+    """
+    data = query_result['clusters'].get(cluster['name'])
+    if data is None or data['token'].get('deleted', False):
+        return None, None
+    token_data = {k: v for k, v in data['token'].items() if k not in SYSTEM_METADATA_KEYS}
+    return token_data, data['etag']
+
+
 def _get_latest_cluster(clusters, query_result):
     """
     :param clusters: list of local cluster configs from the configuration file
-    :param query_result: value from query_token function
+    :param query_result: value from query_token_snapshot function
     :return: Finds latest token configuration from the query_result. Gets the cluster that is configured in the
      token description and returns a local cluster who's serverside name matches the one specified in the token.
      If the token's cluster does not exist in one of the local cluster configurations then an Exception is raised.
@@ -184,8 +319,7 @@ def _get_latest_cluster(clusters, query_result):
     cluster_name_goal = token_result['token']['cluster']
     provided_cluster_names = []
     for c in clusters:
-        cluster_settings, _ = http_util.make_data_request(c, lambda: http_util.get(c, '/settings'))
-        cluster_config_name = cluster_settings['cluster-config']['name']
+        cluster_config_name = get_cluster_config_name(c)
         provided_cluster_names.append(cluster_config_name)
         if cluster_name_goal.upper() == cluster_config_name.upper():
             return c
@@ -193,14 +327,16 @@ def _get_latest_cluster(clusters, query_result):
                     f' The following clusters were provided: {", ".join(provided_cluster_names)}.')
 
 
-def get_target_cluster_from_token(clusters, token_name, enforce_cluster):
+def get_target_cluster_from_token(clusters, token_name, enforce_cluster, query_result=None):
     """
     :param clusters: list of local cluster configs from the configuration file
     :param token_name: string name of token
     :param enforce_cluster: boolean describing if cluster was explicitly specified as an cli argument
+    :param query_result: optional value from query_token_snapshot function, fetched when not provided
     :return: Return the target cluster config for various token operations
     """
-    query_result = query_token(clusters, token_name, include_deleted=True)
+    if query_result is None:
+        query_result = query_token_snapshot(clusters, token_name)
     if query_result["count"] == 0:
         raise Exception('The token does not exist. You must create it first.')
     elif enforce_cluster:
@@ -0,0 +1,67 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+
+# A draining file older than this was left behind by a process that exited before it was drained
+STALE_DRAINING_SECS = 60
+
+
+@contextmanager
+def __locked(path):
+    """Holds an exclusive lock on the spool at the given path, shared with other processes"""
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def append(path, lines, max_bytes):
+    """
+    Appends the given lines to the spool at the given path. Once the spool reaches max_bytes, it is rotated to
+    path.1 (replacing the previous rotation, whose lines are lost), so that the spool takes at most 2 * max_bytes.
+    """
+    with __locked(path):
+        try:
+            if os.path.getsize(path) >= max_bytes:
+                os.replace(path, f'{path}.1')
+        except FileNotFoundError:
+            pass
+        with open(path, 'a') as spool_file:
+            spool_file.writelines(f'{line}\n' for line in lines)
+
+
+def is_empty(path):
+    """Returns true if there are no spooled lines to drain at the given path"""
+    return not any(os.path.exists(p) for p in [path, f'{path}.1', f'{path}.draining'])
+
+
+def take(path):
+    """
+    Moves the oldest spooled lines to the spool's draining file and returns them, or returns None if there are no
+    lines to drain or another process is draining them. The caller must call done(path) once the lines have been
+    handled; if it exits before, the lines are drained again by a later process, i.e. at least once.
+    """
+    draining_path = f'{path}.draining'
+    with __locked(path):
+        try:
+            if time.time() - os.path.getmtime(draining_path) < STALE_DRAINING_SECS:
+                return None
+        except FileNotFoundError:
+            for spooled_path in [f'{path}.1', path]:
+                if os.path.exists(spooled_path):
+                    os.replace(spooled_path, draining_path)
+                    break
+            else:
+                return None
+        os.utime(draining_path)
+        with open(draining_path) as draining_file:
+            return draining_file.read().splitlines()
+
+
+def done(path):
+    """Removes the spool's draining file once its lines have been handled"""
+    with __locked(path):
+        os.remove(f'{path}.draining')
@@ -0,0 +1,74 @@
+from functools import partial
+
+from waiter import agent, terminal
+from waiter.util import check_positive, logging, print_info
+
+
+def start(_, args, __, ___):
+    """Starts the agent in the background, unless it is already running"""
+    if agent.is_running():
+        print_info(f'The agent is already running on {agent.socket_path()}.')
+        return 0
+    if agent.start_in_background(args['idle-timeout']):
+        print_info(f'The agent is {terminal.running("running")} on {agent.socket_path()}.')
+        return 0
+    raise Exception('The agent did not start in time.')
+
+
+def stop(_, __, ___, ____):
+    """Stops the agent, if it is running"""
+    if agent.stop():
+        print_info('The agent has been stopped.')
+    else:
+        print_info('The agent is not running.')
+    return 0
+
+
+def status(_, __, ___, ____):
+    """Prints whether the agent is running, exits with code 1 if it isn't"""
+    if agent.is_running():
+        print_info(f'The agent is {terminal.running("running")} on {agent.socket_path()}.')
+        return 0
+    print_info(f'The agent is {terminal.inactive("not running")}.')
+    return 1
+
+
+def serve(_, args, __, ___):
+    """Runs the agent in the foreground"""
+    from waiter.plugins import get_plugins
+    agent.serve(get_plugins(), args['idle-timeout'])
+    return 0
+
+
+def agent_command(parser, clusters, args, config_path, enforce_cluster):
+    """Calls the sub action for agent command. If no sub action is provided then displays the help message."""
+    logging.debug('args: %s' % args)
+    sub_func = args.get('sub_func', None)
+    if sub_func is None:
+        parser.print_help()
+        return 0
+    else:
+        return sub_func(clusters, args, config_path, enforce_cluster)
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('agent',
+                        help='manage the local agent that runs commands in a long-lived process',
+                        description='Manage the local agent, a long-lived process that keeps HTTP sessions, '
+                                    'connection pools and caches warm across commands. When the WAITER_AGENT '
+                                    'environment variable is set to true, commands are forwarded to the agent over a '
+                                    'Unix domain socket, and the agent is started on demand.')
+    subparsers = parser.add_subparsers()
+    for name, sub_func, help_text in [('start', start, 'start the agent in the background'),
+                                      ('serve', serve, 'run the agent in the foreground')]:
+        sub_parser = subparsers.add_parser(name, help=help_text)
+        sub_parser.add_argument('--idle-timeout', help='exit after this many seconds without any command '
+                                                       f'(default is {agent.DEFAULT_IDLE_TIMEOUT_SECS} seconds)',
+                                dest='idle-timeout', type=check_positive, default=agent.DEFAULT_IDLE_TIMEOUT_SECS)
+        sub_parser.set_defaults(sub_func=sub_func)
+    stop_parser = subparsers.add_parser('stop', help='stop the agent')
+    stop_parser.set_defaults(sub_func=stop)
+    status_parser = subparsers.add_parser('status', help='print whether the agent is running')
+    status_parser.set_defaults(sub_func=status)
+    return partial(agent_command, parser)
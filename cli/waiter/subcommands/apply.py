@@ -0,0 +1,254 @@
+import concurrent
+import hashlib
+import json
+import logging
+import os
+from concurrent import futures
+
+import requests
+
+from waiter import http_util, terminal, token_post
+from waiter.data_format import load_context_matrix, load_data, load_data_matrix
+from waiter.querying import get_existing_token_from_snapshot, get_target_cluster_from_token, query_token_snapshot
+from waiter.token_post import merge_token_fields_from_args, pop_context_override_args
+from waiter.util import check_positive, guard_no_cluster, is_admin_enabled, print_error, print_info, response_message
+
+parser = None
+
+CREATE = 'create'
+UPDATE = 'update'
+NO_OP = 'no-op'
+DRIFT = 'drift'
+
+ACTION_SYMBOLS = {CREATE: '+', UPDATE: '~', NO_OP: '=', DRIFT: '!'}
+
+
+def content_hash(token_fields):
+    """Returns a hash of the canonical JSON representation of the given token fields"""
+    canonical = json.dumps(token_fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def changed_fields(desired_fields, existing_fields):
+    """Returns the sorted list of desired fields whose values differ from the existing ones"""
+    return sorted(k for k, v in desired_fields.items() if existing_fields.get(k) != v)
+
+
+def load_desired_tokens(files, context_file, context_overrides, token_fields_from_args, context_matrix_file=None):
+    """
+    Loads the desired token definitions from the given files, keyed by token name.
+    With a context matrix, every file is rendered as a template once per context of the matrix.
+    """
+    contexts = load_context_matrix(context_matrix_file) if context_matrix_file else None
+    desired_tokens = {}
+    for path in files:
+        options = {'context_file': context_file,
+                   'context_overrides': context_overrides,
+                   'data': path}
+        all_token_fields = load_data_matrix(options, contexts) if contexts else [load_data(options)]
+        for token_fields in all_token_fields:
+            token_fields = merge_token_fields_from_args(token_fields, token_fields_from_args)
+            token_name = token_fields.pop('token', None)
+            if not token_name:
+                raise Exception(f'The token name must be specified in {path}.')
+            if token_name in desired_tokens:
+                raise Exception(f'Token {token_name} is defined more than once.')
+            desired_tokens[token_name] = token_fields
+    return desired_tokens
+
+
+def get_default_create_cluster(clusters):
+    """Returns the cluster in which new tokens should be created"""
+    if len(clusters) == 1:
+        return clusters[0]
+    default_for_create = [c for c in clusters if c.get('default-for-create', False)]
+    if len(default_for_create) == 0:
+        raise Exception('You must either specify a cluster via --cluster or set "default-for-create" to true for '
+                        'one of your configured clusters.')
+    elif len(default_for_create) > 1:
+        raise Exception('You have "default-for-create" set to true for more than one cluster.')
+    return default_for_create[0]
+
+
+def plan_token(clusters, enforce_cluster, token_name, desired_fields, desired_hash):
+    """Returns the list of plan entries that reconcile the given token with its desired fields"""
+    query_result = query_token_snapshot(clusters, token_name)
+    clusters_by_name = {c['name']: c for c in clusters}
+    live_tokens = {}
+    for cluster_name in query_result['clusters']:
+        existing_fields, existing_etag = get_existing_token_from_snapshot(query_result, clusters_by_name[cluster_name])
+        if existing_fields is not None:
+            live_tokens[cluster_name] = existing_fields, existing_etag
+    target_cluster = None
+    if live_tokens:
+        target_cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster, query_result)
+
+    if target_cluster is None:
+        return [{'action': CREATE,
+                 'body': desired_fields,
+                 'cluster': get_default_create_cluster(clusters),
+                 'etag': None,
+                 'fields': sorted(desired_fields),
+                 'token': token_name}]
+
+    entries = []
+    for cluster_name, (existing_fields, existing_etag) in sorted(live_tokens.items()):
+        existing_hash = content_hash({k: existing_fields.get(k) for k in desired_fields})
+        if existing_hash == desired_hash:
+            action = NO_OP
+        elif cluster_name == target_cluster['name']:
+            action = UPDATE
+        else:
+            action = DRIFT
+        entries.append({'action': action,
+                        'body': {**existing_fields, **desired_fields},
+                        'cluster': clusters_by_name[cluster_name],
+                        'etag': existing_etag,
+                        'fields': changed_fields(desired_fields, existing_fields),
+                        'token': token_name})
+    return entries
+
+
+def compute_plan(clusters, enforce_cluster, desired_tokens, parallelism):
+    """Fetches the current state of all desired tokens concurrently and returns the resulting plan entries"""
+    plan = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        token_to_future = {token_name: executor.submit(plan_token, clusters, enforce_cluster, token_name,
+                                                       token_fields, content_hash(token_fields))
+                           for token_name, token_fields in desired_tokens.items()}
+        for token_name, future in sorted(token_to_future.items()):
+            plan.extend(future.result())
+    return plan
+
+
+def format_plan_entry(entry):
+    """Formats a single line of the plan"""
+    action = entry['action']
+    line = f'  {ACTION_SYMBOLS[action]} {action:<7} {terminal.bold(entry["token"])}'
+    if action in (UPDATE, DRIFT):
+        line = f'{line} ({", ".join(entry["fields"])})'
+    if action == CREATE:
+        return terminal.success(line)
+    elif action == UPDATE:
+        return terminal.running(line)
+    elif action == DRIFT:
+        return terminal.inactive(line)
+    else:
+        return line
+
+
+def print_plan(plan):
+    """Prints the plan grouped by cluster, followed by a summary line"""
+    cluster_names = sorted(set(e['cluster']['name'] for e in plan))
+    for cluster_name in cluster_names:
+        print_info(f'Plan for {terminal.bold(cluster_name)}:')
+        for entry in plan:
+            if entry['cluster']['name'] == cluster_name:
+                print_info(format_plan_entry(entry))
+        print_info('')
+    counts = {action: len([e for e in plan if e['action'] == action]) for action in ACTION_SYMBOLS}
+    print_info(f'Plan: {counts[CREATE]} to create, {counts[UPDATE]} to update, '
+               f'{counts[NO_OP]} unchanged, {counts[DRIFT]} drifted.')
+
+
+def post_token(entry, admin_mode):
+    """Posts the body of the given plan entry, returning a (success, message) pair"""
+    cluster = entry['cluster']
+    cluster_name = cluster['name']
+    token_name = entry['token']
+    params = {'token': token_name}
+    if admin_mode:
+        params['update-mode'] = 'admin'
+    headers = {'If-Match': entry['etag'] or ''}
+    try:
+        resp = http_util.post(cluster, 'token', entry['body'], params=params, headers=headers)
+        try:
+            resp_json = resp.json()
+        except ValueError as ve:
+            # e.g. the HTML error page of a proxy in front of the cluster
+            logging.exception(ve)
+            reason = f'Received a non-JSON response with status code {resp.status_code}'
+            return False, token_post.post_failed_message(cluster_name, reason)
+        if resp.status_code == 200 and 'message' in resp_json:
+            return True, f'{resp_json["message"]} on {cluster_name}.'
+        return False, token_post.post_failed_message(cluster_name, response_message(resp_json))
+    except requests.exceptions.ReadTimeout as rt:
+        logging.exception(rt)
+        return False, terminal.failed(f'Encountered read timeout with {cluster_name} ({cluster["url"]}) '
+                                      f'while applying {token_name}. Your post may have completed.')
+    except IOError as ioe:
+        logging.exception(ioe)
+        reason = f'Cannot connect to {cluster_name} ({cluster["url"]})'
+        return False, token_post.post_failed_message(cluster_name, reason)
+
+
+def apply_plan(plan, admin_mode, parallelism):
+    """Applies the create and update entries of the plan with bounded concurrency, returns True if all succeeded"""
+    changes = [e for e in plan if e['action'] in (CREATE, UPDATE)]
+    overall_success = True
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        change_futures = [executor.submit(post_token, entry, admin_mode) for entry in changes]
+        for future in change_futures:
+            success, message = future.result()
+            if success:
+                print_info(message)
+            else:
+                print_error(message)
+            overall_success = overall_success and success
+    return overall_success
+
+
+def apply(clusters, args, _, enforce_cluster):
+    """Reconciles the tokens defined in the given files with their state across clusters"""
+    guard_no_cluster(clusters)
+    logging.debug('args: %s' % args)
+    files = args.pop('files')
+    admin_mode = args.pop('admin', None)
+    dry_run = args.pop('dry-run', False)
+    parallelism = args.pop('parallelism', os.cpu_count())
+    context_file = args.pop('context', None)
+    context_matrix_file = args.pop('context-matrix', None)
+    context_overrides = pop_context_override_args(args)
+    desired_tokens = load_desired_tokens(files, context_file, context_overrides, args, context_matrix_file)
+
+    plan = compute_plan(clusters, enforce_cluster, desired_tokens, parallelism)
+    print_plan(plan)
+    if dry_run or not any(e['action'] in (CREATE, UPDATE) for e in plan):
+        return 0
+    print_info('')
+    return 0 if apply_plan(plan, admin_mode, parallelism) else 1
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    global parser
+    parser = add_parser('apply',
+                        help='reconcile tokens with their definitions in files',
+                        description='Reconcile Waiter tokens with the definitions in the given JSON/YAML files. '
+                                    'Each file must provide the token name in its "token" field. A plan of creates, '
+                                    'updates, unchanged tokens and drifted clusters is printed before any change is '
+                                    'applied. In addition to the optional arguments explicitly listed below, you can '
+                                    'provide any Waiter token parameter as a flag to set it on every token.')
+    parser.add_argument('files', nargs='+', help='JSON/YAML files containing the desired token definitions')
+    if is_admin_enabled():
+        parser.add_argument('--admin', '-a', help='run command in admin mode', action='store_true')
+    parser.add_argument('--dry-run', '-n', help='print the plan without applying any changes',
+                        dest='dry-run', action='store_true')
+    parser.add_argument('--parallelism', '-p', help='maximum number of concurrent token operations',
+                        type=check_positive, default=os.cpu_count())
+    parser.add_argument('--context', dest='context',
+                        help='this JSON/YAML file provides the context variables used '
+                             'to render the data files as templates')
+    parser.add_argument('--context-matrix', dest='context-matrix',
+                        help='this JSON/YAML file provides either a list of contexts or a dictionary of parameter '
+                             'lists whose cartesian product is the list of contexts; every data file is rendered '
+                             'once per context, e.g. to generate a token per region and shard from one template')
+    return apply
+
+
+def add_implicit_arguments(unknown_args):
+    """
+    Given the list of "unknown" args, dynamically adds proper arguments to
+    the subparser, allowing us to support any token parameter as a flag
+    """
+    token_post.add_implicit_arguments(unknown_args, parser)
@@ -0,0 +1,120 @@
+import io
+import json
+import shlex
+import sys
+import time
+from contextlib import redirect_stderr, redirect_stdout
+
+from waiter.util import logging, print_info
+
+# Sub-commands that cannot run in a batch: ssh replaces the process with ssh or kubectl,
+# and the agent and batch sub-commands would take over the batch's process
+UNSUPPORTED_ACTIONS = ['agent', 'batch', 'ssh']
+
+
+def parse_command(line):
+    """
+    Parses a line of the batch into a command, either a JSON object with the "args" (a list or a string) and
+    an optional "id" of the command, or a command line; returns None for blank lines and comments
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        command = json.loads(line)
+        if 'args' not in command:
+            raise Exception(f'The command {line} must provide its "args".')
+    else:
+        command = {'args': line}
+    args = command['args']
+    args = shlex.split(args) if isinstance(args, str) else [str(a) for a in args]
+    if args and args[0] == 'waiter':
+        args = args[1:]
+    return {**command, 'args': args}
+
+
+def load_commands(path):
+    """Loads the commands of the batch from the file at the given path, or from stdin"""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path) as batch_file:
+            lines = batch_file.read().splitlines()
+    commands = []
+    for line in lines:
+        command = parse_command(line)
+        if command is not None:
+            commands.append(command)
+    return commands
+
+
+def run_batch_command(command, config_path, plugins):
+    """
+    Runs the given command, capturing its output (including the output of its worker threads, since the
+    process' standard streams are redirected while it runs), and returns its result
+    """
+    from waiter.cli import find_action, run_command
+    args = command['args']
+    if config_path and not any(a in ['--config', '-C'] for a in args):
+        args = ['--config', config_path] + args
+    stdout, stderr = io.StringIO(), io.StringIO()
+    start_time = time.time()
+    action = find_action(args)
+    if action in UNSUPPORTED_ACTIONS:
+        stderr.write(f'The {action} command cannot be run in a batch.\n')
+        exit_code = 1
+    else:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            exit_code = run_command(args, plugins)
+    result = {'args': command['args'],
+              'elapsed-secs': round(time.time() - start_time, 3),
+              'exit-code': exit_code,
+              'stderr': stderr.getvalue(),
+              'stdout': stdout.getvalue()}
+    if 'id' in command:
+        result['id'] = command['id']
+    return result
+
+
+def batch(_, args, config_path, __):
+    """
+    Runs the commands of the batch in this process, one at a time, and prints the result of each of them as a line
+    of JSON. Like the commands run by the agent, each command takes over the process' standard streams, logging
+    and metrics while it runs, and only the work within a command (e.g. querying several clusters) is concurrent.
+    """
+    from waiter.plugins import get_plugins
+    logging.debug('args: %s' % args)
+    commands = load_commands(args['file'])
+    fail_fast = args.get('fail-fast', False)
+    plugins = get_plugins()
+    failures = 0
+    # commands must not wait for input that will never come, e.g. when the batch itself is read from stdin
+    saved_stdin = sys.stdin
+    sys.stdin = io.StringIO()
+    try:
+        for index, command in enumerate(commands):
+            result = {'index': index, **run_batch_command(command, config_path, plugins)}
+            print_info(json.dumps(result))
+            if result['exit-code'] != 0:
+                failures += 1
+                if fail_fast:
+                    break
+    finally:
+        sys.stdin = saved_stdin
+    return 1 if failures else 0
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('batch',
+                        help='run many commands in one process',
+                        description='Run the commands read from a file (or stdin) in this process, sharing its HTTP '
+                                    'session and caches. Each line holds either a command line, e.g. "show my-token", '
+                                    'or a JSON object with the "args" of the command (a list or a string) and an '
+                                    'optional "id". The result of each command, including its exit code and output, '
+                                    'is printed as a line of JSON as soon as the command completes. Commands run one '
+                                    'at a time and non-interactively, i.e. without any standard input.')
+    parser.add_argument('file', nargs='?', default='-', help='the file holding the commands (default is stdin)')
+    parser.add_argument('--fail-fast', help='skip the remaining commands once a command has failed',
+                        dest='fail-fast', action='store_true')
+    return batch
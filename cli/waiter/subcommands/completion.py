@@ -0,0 +1,176 @@
+from functools import partial
+
+from waiter import name_index
+from waiter.util import guard_no_cluster, logging, print_info
+
+# Sub-commands whose positional arguments are token names
+TOKEN_SUBCOMMANDS = ['create', 'delete', 'init', 'kill', 'maintenance', 'ping', 'show', 'ssh', 'start', 'stop',
+                     'update']
+
+# Sub-commands whose positional arguments can also be service ids
+SERVICE_SUBCOMMANDS = ['kill', 'logs', 'ping', 'ssh']
+
+# The completion scripts look names up with look(1), a binary search over the sorted index files,
+# falling back to a linear scan when look is not installed
+BASH_SCRIPT = '''_waiter_names() {
+    local prefix="$1"; shift
+    local index_file
+    for index_file in "$@"; do
+        [ -f "$index_file" ] || continue
+        if command -v look >/dev/null 2>&1; then
+            LC_ALL=C look -- "$prefix" "$index_file"
+        else
+            awk -v prefix="$prefix" 'index($0, prefix) == 1' "$index_file"
+        fi
+    done
+}
+
+_waiter() {
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+    local index_dir="${XDG_CACHE_HOME:-$HOME/.cache}/waiter"
+    local subcommand="" skip_next="" i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        if [ -n "$skip_next" ]; then
+            skip_next=""
+        else
+            case "${COMP_WORDS[i]}" in
+                %(global_flags)s) skip_next=1 ;;
+                -*) ;;
+                *) subcommand="${COMP_WORDS[i]}"; break ;;
+            esac
+        fi
+    done
+    COMPREPLY=()
+    if [ -z "$subcommand" ]; then
+        [ -n "$skip_next" ] || COMPREPLY=($(compgen -W "%(subcommands)s" -- "$cur"))
+        return
+    fi
+    case "$cur" in -*) return ;; esac
+    local index_files=()
+    case "$subcommand" in
+        %(token_subcommands)s) index_files+=("$index_dir/completion-tokens-$USER.txt") ;;
+    esac
+    case "$subcommand" in
+        %(service_subcommands)s) index_files+=("$index_dir/completion-services.txt") ;;
+    esac
+    COMPREPLY=($(_waiter_names "$cur" "${index_files[@]}"))
+}
+
+complete -o default -F _waiter waiter
+'''
+
+ZSH_SCRIPT = '''#compdef waiter
+
+_waiter_names() {
+    local prefix="$1"; shift
+    local index_file
+    for index_file in "$@"; do
+        [[ -f "$index_file" ]] || continue
+        if (( $+commands[look] )); then
+            LC_ALL=C look -- "$prefix" "$index_file"
+        else
+            awk -v prefix="$prefix" 'index($0, prefix) == 1' "$index_file"
+        fi
+    done
+}
+
+_waiter() {
+    local index_dir="${XDG_CACHE_HOME:-$HOME/.cache}/waiter"
+    local subcommand="" skip_next="" i
+    for ((i = 2; i < CURRENT; i++)); do
+        if [[ -n "$skip_next" ]]; then
+            skip_next=""
+        else
+            case "${words[i]}" in
+                %(global_flags)s) skip_next=1 ;;
+                -*) ;;
+                *) subcommand="${words[i]}"; break ;;
+            esac
+        fi
+    done
+    if [[ -z "$subcommand" ]]; then
+        [[ -n "$skip_next" ]] || compadd -- %(subcommands)s
+        return
+    fi
+    [[ "$PREFIX" == -* ]] && return
+    local -a index_files names
+    case "$subcommand" in
+        %(token_subcommands)s) index_files+=("$index_dir/completion-tokens-$USER.txt") ;;
+    esac
+    case "$subcommand" in
+        %(service_subcommands)s) index_files+=("$index_dir/completion-services.txt") ;;
+    esac
+    names=(${(f)"$(_waiter_names "$PREFIX" "${index_files[@]}")"})
+    compadd -- $names
+}
+
+compdef _waiter waiter
+'''
+
+
+def completion_script(template):
+    """Renders the given completion script template with the CLI's sub-commands and global flags"""
+    from waiter.cli import GLOBAL_FLAGS_WITH_VALUES, subcommands
+    return template % {'global_flags': '|'.join(GLOBAL_FLAGS_WITH_VALUES),
+                       'service_subcommands': '|'.join(SERVICE_SUBCOMMANDS),
+                       'subcommands': ' '.join(sorted(subcommands)),
+                       'token_subcommands': '|'.join(TOKEN_SUBCOMMANDS)}
+
+
+def print_script(template, _, __, ___, ____):
+    """Prints the completion script, which is meant to be sourced by the shell, and enables the name index"""
+    name_index.enable()
+    print_info(completion_script(template), end='')
+    return 0
+
+
+def refresh(clusters, _, __, ___):
+    """Re-indexes the names of the tokens owned by the current user across clusters"""
+    guard_no_cluster(clusters)
+    count = name_index.refresh_tokens(clusters)
+    logging.debug(f'indexed {count} token name(s)')
+    return 0
+
+
+def names(_, args, __, ___):
+    """Prints the indexed names that start with the given prefix"""
+    prefix = args.get('prefix', '')
+    index_path = name_index.services_index_path() if args.get('services') else name_index.tokens_index_path()
+    for name in name_index.query_names(index_path, prefix):
+        print_info(name)
+    return 0
+
+
+def completion(parser, clusters, args, config_path, enforce_cluster):
+    """Calls the sub action for completion command. If no sub action is provided then displays the help message."""
+    logging.debug('args: %s' % args)
+    sub_func = args.get('sub_func', None)
+    if sub_func is None:
+        parser.print_help()
+        return 0
+    else:
+        return sub_func(clusters, args, config_path, enforce_cluster)
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('completion',
+                        help='shell completion of sub-commands, token names and service ids',
+                        description='Shell completion of sub-commands, token names and service ids. Enable it by '
+                                    'adding "source <(waiter completion bash)" to ~/.bashrc, or '
+                                    '"source <(waiter completion zsh)" to ~/.zshrc. Names are completed from a local '
+                                    'index of the tokens you own and of the services seen by recent commands, which '
+                                    'is maintained by the commands run once completion has been enabled.')
+    subparsers = parser.add_subparsers()
+    bash_parser = subparsers.add_parser('bash', help='print the bash completion script')
+    bash_parser.set_defaults(sub_func=partial(print_script, BASH_SCRIPT))
+    zsh_parser = subparsers.add_parser('zsh', help='print the zsh completion script')
+    zsh_parser.set_defaults(sub_func=partial(print_script, ZSH_SCRIPT))
+    refresh_parser = subparsers.add_parser('refresh', help='refresh the index of the token names you own')
+    refresh_parser.set_defaults(sub_func=refresh)
+    names_parser = subparsers.add_parser('names', help='print the indexed names that start with a prefix')
+    names_parser.add_argument('prefix', nargs='?', default='')
+    names_parser.add_argument('--services', '-s', help='print service ids instead of token names',
+                              action='store_true')
+    names_parser.set_defaults(sub_func=names)
+    return partial(completion, parser)
@@ -0,0 +1,199 @@
+import collections
+import concurrent
+import heapq
+import logging
+import re
+import time
+from concurrent import futures
+
+from waiter import http_util, terminal
+from waiter.querying import get_log_directory_entries, print_no_data, print_no_instances, query_service
+from waiter.util import check_positive, guard_no_cluster, print_error, print_info
+
+# The log files that are streamed unless other files are given
+DEFAULT_FILE_NAMES = ['stdout', 'stderr']
+
+# Size of the blocks in which the log files are downloaded; at most two blocks of each file (the one being merged
+# and the next one) are held while the files are merged, which bounds the memory used regardless of their size
+BLOCK_BYTES = 262144
+
+# Maximum number of log file blocks downloaded at once
+MAX_CONCURRENT_READS = 16
+
+# Default number of seconds between the reads of the new lines of the log files in follow mode
+DEFAULT_FOLLOW_INTERVAL_SECS = 2
+
+# Timestamp at the start of a log line, e.g. 2020-01-31T12:34:56.789Z or 2020-01-31 12:34:56,789
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?')
+
+
+class LogFile:
+    """A log file of an instance, which is read incrementally: each read starts where the previous one ended"""
+
+    def __init__(self, cluster, instance_id, name, url):
+        self.cluster = cluster
+        self.instance_id = instance_id
+        self.name = name
+        self.url = url
+        self.offset = 0
+        self.timestamp = ''
+        self.prefix = f'{terminal.bold(instance_id)} {name} | '
+
+    def timestamped(self, line):
+        """
+        Returns the given line along with its timestamp; lines without a timestamp of their own (e.g. the lines
+        of a stack trace) get the timestamp of the line before them, so that they stay together
+        """
+        match = TIMESTAMP_PATTERN.match(line)
+        if match:
+            self.timestamp = match.group().replace(' ', 'T').replace(',', '.')
+        return self.timestamp, line
+
+    def read_block(self, final):
+        """
+        Returns the (timestamp, line) pairs of the complete lines in the block of the file starting at the offset,
+        along with whether the file may hold more bytes after the block. The bytes before the offset are not
+        downloaded again, and an incomplete last line is left for the next read, unless this is the final read and
+        the end of the file has been reached.
+        """
+        block_bytes = BLOCK_BYTES
+        while True:
+            headers = {'Range': f'bytes={self.offset}-{self.offset + block_bytes - 1}'}
+            with http_util.get_streaming(self.cluster, self.url, headers=headers) as resp:
+                if resp.status_code == 416:
+                    # nothing has been appended since the last read
+                    return [], False
+                if resp.status_code not in [200, 206]:
+                    raise Exception(f'Encountered status code {resp.status_code} when reading {self.name} of '
+                                    f'instance {self.instance_id}.')
+                data = resp.content
+            if resp.status_code == 200:
+                # a server which does not support ranges sends the whole file
+                data = data[self.offset:]
+                more = False
+            else:
+                more = len(data) == block_bytes
+            end = data.rfind(b'\n') + 1
+            if more and end == 0:
+                # the block only holds part of a line, which is downloaded again along with the rest of it
+                block_bytes *= 2
+                continue
+            if final and not more:
+                end = len(data)
+            self.offset += end
+            lines = data[:end].split(b'\n')
+            if lines[-1] == b'':
+                lines.pop()
+            return [self.timestamped(line.decode(errors='replace')) for line in lines], more
+
+
+def read_block(log_file, final):
+    """Reads the next block of the log file, printing the error (and ending the file) if it can't be read"""
+    try:
+        return log_file.read_block(final)
+    except Exception as e:
+        logging.exception(f'exception when reading {log_file.url}')
+        print_error(str(e))
+        return [], False
+
+
+def print_new_lines(executor, log_files, final):
+    """
+    Reads the new lines of all the log files concurrently and prints them merged by timestamp. The lines of each
+    file are in order, so only the next line of each file has to be compared. Each file is read in blocks by
+    the executor, the next block of a file being downloaded while the lines of its current block are merged.
+    """
+    blocks = [executor.submit(read_block, log_file, final) for log_file in log_files]
+    buffers = [collections.deque() for _ in log_files]
+    next_lines = []
+
+    def push_next_line(index):
+        while not buffers[index]:
+            if blocks[index] is None:
+                return
+            lines, more = blocks[index].result()
+            blocks[index] = executor.submit(read_block, log_files[index], final) if more else None
+            buffers[index].extend(lines)
+        timestamp, line = buffers[index].popleft()
+        heapq.heappush(next_lines, (timestamp, index, line))
+
+    for index in range(len(log_files)):
+        push_next_line(index)
+    while next_lines:
+        _, index, line = heapq.heappop(next_lines)
+        print_info(f'{log_files[index].prefix}{line}')
+        push_next_line(index)
+
+
+def find_log_files(clusters, service_id, instance_ids, file_names, include_failed_instances,
+                   include_killed_instances):
+    """Returns the log files with the given names of the selected instances of the service, or None if not found"""
+    query_result = query_service(clusters, service_id)
+    if query_result['count'] == 0:
+        print_no_data(clusters)
+        return None
+    clusters_by_name = {c['name']: c for c in clusters}
+    instances = []
+    for cluster_name, data in query_result['clusters'].items():
+        service_instances = data['service']['instances']
+        instances += [(clusters_by_name[cluster_name], instance)
+                      for key, included in [('active-instances', True),
+                                            ('failed-instances', include_failed_instances),
+                                            ('killed-instances', include_killed_instances)]
+                      if included
+                      for instance in service_instances[key]
+                      if not instance_ids or instance['id'] in instance_ids]
+    if len(instances) == 0:
+        print_no_instances(service_id)
+        return None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(instances), 16)) as executor:
+        entries_futures = [executor.submit(get_log_directory_entries, cluster, service_id, instance)
+                           for cluster, instance in instances]
+        return [LogFile(cluster, instance['id'], entry['name'], entry['url'])
+                for (cluster, instance), entries_future in zip(instances, entries_futures)
+                for entry in entries_future.result()
+                if entry.get('type') == 'file' and entry['name'] in file_names]
+
+
+def logs(clusters, args, _, __):
+    """Prints the log files of the instances of a service, merged by timestamp"""
+    guard_no_cluster(clusters)
+    service_id = args['service-id']
+    follow = args.get('follow', False)
+    log_files = find_log_files(clusters, service_id, args.get('instance-id'), args.get('file') or DEFAULT_FILE_NAMES,
+                               args.get('failed', False), args.get('killed', False))
+    if log_files is None:
+        return 1
+    if len(log_files) == 0:
+        print_info(f'There are no matching log files for service id {service_id}.')
+        return 1
+    # the readers are shared by all the reads, so that following the logs never adds threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(log_files), MAX_CONCURRENT_READS)) as executor:
+        print_new_lines(executor, log_files, final=not follow)
+        while follow:
+            time.sleep(args['interval'])
+            print_new_lines(executor, log_files, final=False)
+    return 0
+
+
+def register(add_parser):
+    """Adds this sub-command's parser and returns the action function"""
+    parser = add_parser('logs',
+                        help='print the logs of the instances of a service',
+                        description='Print the log files (stdout and stderr by default) of the active instances of a '
+                                    'service, read concurrently and merged by the timestamps at the start of their '
+                                    'lines. Each line is prefixed with its instance id and file name.')
+    parser.add_argument('service-id')
+    parser.add_argument('--instance-id', '-i', help='only print the logs of this instance (can be repeated)',
+                        dest='instance-id', action='append')
+    parser.add_argument('--file', help=f'the name of a log file to print (can be repeated, default is '
+                                       f'{" and ".join(DEFAULT_FILE_NAMES)})',
+                        action='append')
+    parser.add_argument('--failed', help='also print the logs of the failed instances', action='store_true')
+    parser.add_argument('--killed', help='also print the logs of the killed instances', action='store_true')
+    parser.add_argument('--follow', '-f', help='keep printing the lines appended to the log files, only downloading '
+                                               'the new lines, until interrupted', action='store_true')
+    parser.add_argument('--interval', help='with --follow, the number of seconds between reads of the new lines '
+                                           f'(default is {DEFAULT_FOLLOW_INTERVAL_SECS} seconds)',
+                        type=check_positive, default=DEFAULT_FOLLOW_INTERVAL_SECS)
+    return logs
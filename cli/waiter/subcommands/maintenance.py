@@ -4,7 +4,7 @@ import requests
 
 from waiter import terminal, http_util
 from waiter.action import ping_token_on_cluster, process_kill_request
-from waiter.querying import get_target_cluster_from_token, get_token
+from waiter.querying import get_existing_token_from_snapshot, get_target_cluster_from_token, query_token_snapshot
 from waiter.token_post import post_failed_message, process_post_result
 from waiter.util import check_positive, guard_no_cluster, logging, print_info
 
@@ -15,8 +15,9 @@ def _is_token_in_maintenance_mode(token_data):
 
 def _get_existing_token_data(clusters, token_name, enforce_cluster):
     guard_no_cluster(clusters)
-    cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster)
-    existing_token_data, existing_token_etag = get_token(cluster, token_name)
+    query_result = query_token_snapshot(clusters, token_name)
+    cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster, query_result)
+    existing_token_data, existing_token_etag = get_existing_token_from_snapshot(query_result, cluster)
     return cluster, existing_token_data, existing_token_etag
 
 
@@ -1,8 +1,7 @@
-from tabulate import tabulate
 from functools import reduce
 
 from waiter import terminal
-from waiter.data_format import display_data
+from waiter.data_format import display_query_result_stream
 from waiter.format import format_field_name, format_mem_field, format_timestamp_string
 
 from waiter.display import tabulate_token_services
@@ -12,6 +11,7 @@ from waiter.util import guard_no_cluster
 
 def tabulate_token(cluster_or_cluster_group_name, token, token_name, services, token_etag):
     """Given a token, returns a string containing tables for the fields"""
+    from tabulate import tabulate
     table = [['Owner', token['owner']]]
     if token.get('name'):
         table.append(['Name', token['name']])
@@ -66,18 +66,32 @@ def tabulate_token(cluster_or_cluster_group_name, token, token_name, services, t
         f'{service_table}'
 
 
+def cluster_token_to_records(cluster_name, entities):
+    """Returns an NDJSON record for the token of the given cluster, followed by one record per service"""
+    if entities['count'] == 0:
+        return []
+    token_record = {'cluster': cluster_name, 'etag': entities['etag'], 'token': entities['token']}
+    service_records = [{'cluster': cluster_name, 'service': service} for service in entities.get('services', [])]
+    return [token_record, *service_records]
+
+
 def show(clusters, args, _, enforce_cluster):
     """Prints info for the token with the given token name."""
     guard_no_cluster(clusters)
     as_json = args.get('json')
     as_yaml = args.get('yaml')
+    as_ndjson = args.get('ndjson')
     token_name = args.get('token')[0]
     include_services = not args.get('no-services')
 
+    if as_json or as_yaml or as_ndjson:
+        cluster_names = [c['name'] for c in clusters]
+        cluster_results = query_token(clusters, token_name, include_services=include_services, as_completed=True)
+        count = display_query_result_stream(args, cluster_names, cluster_results, cluster_token_to_records)
+        return 0 if count > 0 else 1
+
     query_result = query_token(clusters, token_name, include_services=include_services)
-    if as_json or as_yaml:
-        display_data(args, query_result)
-    elif enforce_cluster:
+    if enforce_cluster:
         for cluster_name, entities in query_result['clusters'].items():
             services = [{'cluster': cluster_name, **service}
                         for service in entities.get('services', [])]
@@ -106,8 +120,7 @@ def show(clusters, args, _, enforce_cluster):
     if query_result['count'] > 0:
         return 0
     else:
-        if not as_json and not as_yaml:
-            print_no_data(clusters)
+        print_no_data(clusters)
         return 1
 
 
@@ -120,4 +133,6 @@ def register(add_parser):
     format_group = show_parser.add_mutually_exclusive_group()
     format_group.add_argument('--json', help='show the data in JSON format', dest='json', action='store_true')
     format_group.add_argument('--yaml', help='show the data in YAML format', dest='yaml', action='store_true')
+    format_group.add_argument('--ndjson', help='show the token and each of its services as one JSON record per line',
+                              dest='ndjson', action='store_true')
     return show
@@ -1,16 +1,33 @@
 import argparse
+import collections
+import concurrent
 import logging
 import os
+import signal
+import subprocess
+import threading
+from concurrent import futures
 from enum import Enum
 
-from waiter import plugins, terminal
-from waiter.display import get_user_selection, tabulate_service_instances, tabulate_token_services
+from waiter import instance_cache, plugins, terminal
+from waiter.display import get_user_selection, service_instance_columns, sort_token_services, token_service_columns
 from waiter.querying import get_service_id_from_instance_id, get_target_cluster_from_token, print_no_data, \
-    print_no_services, query_service, query_token, get_services_on_cluster, print_no_instances
-from waiter.util import guard_no_cluster, is_admin_enabled, print_info
+    print_no_services, query_healthy_instances, query_service, query_token, \
+    get_service_on_cluster, get_services_on_cluster, print_no_instances
+from waiter.util import check_positive, guard_no_cluster, is_admin_enabled, print_info
 
 BASH_PATH = '/bin/bash'
 
+# Number of the top-ranked services of a token that are retrieved in the background while the user is prompted
+# to choose one of them
+PREFETCH_COUNT = 3
+
+# Default number of instances on which a command runs concurrently when running it on all instances
+DEFAULT_PARALLELISM = 10
+
+# Default number of seconds after which a command running on all instances is killed on the instances
+DEFAULT_TIMEOUT_SECS = 60
+
 
 class Destination(Enum):
     TOKEN = 'token'
@@ -22,9 +39,40 @@ def map_instances_with_status(instances, status):
     return [{'_status': status, **inst} for inst in instances]
 
 
+def get_all_instances(service):
+    """Returns the active, failed and killed instances of the given service"""
+    return (map_instances_with_status(service['instances']['active-instances'], 'active') +
+            map_instances_with_status(service['instances']['failed-instances'], 'failed') +
+            map_instances_with_status(service['instances']['killed-instances'], 'killed'))
+
+
+def find_instance(clusters, instance_id):
+    """
+    Finds the instance with the given id, caching the instances found along the way. The clusters' instance
+    lists are queried first, since they only return the healthy instances of the service; the services
+    themselves are only retrieved when the instance is not healthy (e.g. it failed or was killed).
+    """
+    service_id = get_service_id_from_instance_id(instance_id)
+    clusters_by_name = {c['name']: c for c in clusters}
+    for query_fn, get_instances in [(query_healthy_instances,
+                                     lambda data: map_instances_with_status(data['instances'], 'active')),
+                                    (query_service,
+                                     lambda data: get_all_instances(data['service']))]:
+        query_result = query_fn(clusters, service_id)
+        found_instance = None
+        for cluster_name, data in query_result['clusters'].items():
+            instances = get_instances(data)
+            instance_cache.put_instances(clusters_by_name[cluster_name], instances)
+            found_instance = found_instance or next((i for i in instances if i['id'] == instance_id), None)
+        if found_instance:
+            return found_instance
+        logging.debug(f'instance {instance_id} is not among the instances found using {query_fn.__name__}')
+    return None
+
+
 def get_instances_from_service_id(clusters, service_id, include_active_instances, include_failed_instances,
-                                  include_killed_instances):
-    query_result = query_service(clusters, service_id)
+                                  include_killed_instances, query_result=None):
+    query_result = query_result or query_service(clusters, service_id)
     num_services = query_result['count']
     if num_services == 0:
         return False
@@ -40,24 +88,24 @@ def get_instances_from_service_id(clusters, service_id, include_active_instances
     return instances
 
 
-def kubectl_exec_to_instance(kubectl_cmd, namespace, pod_name, container_name, log_directory,
-                             command_to_run=None, api_server=None, context=None):
+def kubectl_exec_args(namespace, pod_name, container_name, log_directory, command_to_run=None, api_server=None,
+                      context=None, tty=True):
+    """Returns the kubectl arguments that run the command (or a shell) in the log directory of the given pod"""
     if context is not None:
         args = ['--context', context]
     elif api_server is not None:
         args = ['--server', api_server]
-    args = [*args,
+    return [*args,
             '--namespace', namespace,
             'exec',
-            '-it', pod_name,
+            *(['-it'] if tty else []), pod_name,
             '-c', container_name,
             '--',
             '/bin/bash', '-c', f"cd {log_directory}; {' '.join(command_to_run) or 'exec /bin/bash'}"]
-    os.execlp(kubectl_cmd, 'kubectl', *args)
 
 
-def ssh_instance(instance, container_name, command_to_run=None):
-    print_info(f'Attempting to ssh into instance {terminal.bold(instance["id"])}...')
+def instance_command(instance, container_name, command_to_run=None, tty=True):
+    """Returns the command line (ssh or kubectl exec) that runs the command (or a shell) on the given instance"""
     log_directory = instance['log-directory']
     k8s_pod_name = instance.get('k8s/pod-name', False)
     if k8s_pod_name:
@@ -65,57 +113,179 @@ def ssh_instance(instance, container_name, command_to_run=None):
         k8s_api_server = instance['k8s/api-server-url']
         kubectl_cmd = os.getenv('WAITER_KUBECTL', plugins.get_fn('get-kubectl-cmd', lambda: 'kubectl')())
         k8s_namespace = instance['k8s/namespace']
-        print_info(f'Executing ssh to k8s pod {terminal.bold(k8s_pod_name)}')
         logging.debug(f'Executing ssh to k8s pod {terminal.bold(k8s_pod_name)} '
                       f'using namespace={k8s_namespace} api_server={k8s_api_server}')
-        kubectl_exec_to_instance(kubectl_cmd, k8s_namespace, k8s_pod_name, container_name,
-                                 log_directory, command_to_run, api_server=k8s_api_server, context=context)
+        return [kubectl_cmd, *kubectl_exec_args(k8s_namespace, k8s_pod_name, container_name, log_directory,
+                                                command_to_run, api_server=k8s_api_server, context=context, tty=tty)]
     else:
         hostname = instance['host']
         command_to_run = command_to_run or [BASH_PATH]
         ssh_cmd = os.getenv('WAITER_SSH', 'ssh')
-        args = [ssh_cmd, '-t', hostname, 'cd', log_directory, ';'] + command_to_run
-        print_info(f'Executing ssh to {terminal.bold(hostname)}')
-        os.execlp(ssh_cmd, *args)
+        return [ssh_cmd, '-t' if tty else '-T', hostname, 'cd', log_directory, ';'] + command_to_run
 
 
-def ssh_instance_id(clusters, instance_id, command, container_name):
-    service_id = get_service_id_from_instance_id(instance_id)
-    instances = get_instances_from_service_id(clusters, service_id, True, True, True)
-    if instances is False:
-        print_no_data(clusters)
-        return 1
-    found_instance = next((instance
-                           for instance in instances
-                           if instance['id'] == instance_id),
-                          False)
+def ssh_instance(instance, container_name, command_to_run=None):
+    print_info(f'Attempting to ssh into instance {terminal.bold(instance["id"])}...')
+    command = instance_command(instance, container_name, command_to_run)
+    k8s_pod_name = instance.get('k8s/pod-name', False)
+    if k8s_pod_name:
+        print_info(f'Executing ssh to k8s pod {terminal.bold(k8s_pod_name)}')
+        os.execlp(command[0], 'kubectl', *command[1:])
+    else:
+        print_info(f'Executing ssh to {terminal.bold(instance["host"])}')
+        os.execlp(command[0], *command)
+
+
+def kill_process_group(process):
+    """Kills the given process along with the processes it started (e.g. an ssh ProxyCommand)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_on_instance(instance, container_name, command_to_run, timeout_secs, print_lock, processes, stopped):
+    """
+    Runs the command on the given instance, printing each line of its output prefixed with the instance id, and
+    returns its exit code, or None if it did not complete within timeout_secs (in which case it is killed).
+    The process is tracked in processes while it runs, and is not started once stopped is set.
+    """
+    if stopped.is_set():
+        return None
+    command = instance_command(instance, container_name, command_to_run, tty=False)
+    logging.debug(f'running {command} on instance {instance["id"]}')
+    prefix = f'{terminal.bold(instance["id"])} | '
+    try:
+        # in its own session, so that all of its processes can be killed together
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, universal_newlines=True, errors='replace',
+                                   start_new_session=True)
+    except OSError as e:
+        with print_lock:
+            print_info(f'{prefix}{e}')
+        return 127
+    processes.add(process)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        kill_process_group(process)
+
+    timer = threading.Timer(timeout_secs, kill)
+    timer.start()
+    try:
+        if stopped.is_set():
+            kill_process_group(process)
+        for line in process.stdout:
+            with print_lock:
+                print_info(f'{prefix}{line}', end='' if line.endswith('\n') else '\n')
+        exit_code = process.wait()
+    finally:
+        timer.cancel()
+        processes.discard(process)
+    return None if timed_out.is_set() else exit_code
+
+
+def run_on_instances(instances, container_name, command_to_run, parallelism, timeout_secs):
+    """
+    Runs the command on all the given instances, on at most parallelism instances at a time, streaming their output,
+    and prints a summary of their exit codes; returns 0 only if the command succeeded on every instance
+    """
+    if not command_to_run:
+        raise Exception('You must provide the command to run on all instances.')
+    print_info(f'Running {terminal.bold(" ".join(command_to_run))} on {len(instances)} instance(s)...')
+    print_lock = threading.Lock()
+    processes = set()
+    stopped = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [(instance, executor.submit(run_on_instance, instance, container_name, command_to_run,
+                                              timeout_secs, print_lock, processes, stopped))
+                   for instance in instances]
+        instance_ids_by_exit_code = collections.defaultdict(list)
+        try:
+            for instance, future in futures:
+                instance_ids_by_exit_code[future.result()].append(instance['id'])
+        except BaseException:
+            # e.g. on SIGINT, which the processes do not receive, since they run in their own sessions
+            stopped.set()
+            for process in list(processes):
+                kill_process_group(process)
+            raise
+    print_info('')
+    for exit_code in sorted(instance_ids_by_exit_code, key=lambda c: (c is None, c or 0)):
+        instance_ids = instance_ids_by_exit_code[exit_code]
+        if exit_code == 0:
+            outcome = terminal.success('succeeded')
+        elif exit_code is None:
+            outcome = terminal.failed(f'timed out after {timeout_secs} seconds')
+        else:
+            outcome = terminal.failed(f'failed with exit code {exit_code}')
+        print_info(f'{len(instance_ids)} instance(s) {outcome}: {", ".join(instance_ids)}')
+    return 0 if list(instance_ids_by_exit_code) == [0] else 1
+
+
+def ssh_instance_id(clusters, instance_id, command, container_name, fan_out):
+    found_instance = instance_cache.get_instance(clusters, instance_id) or find_instance(clusters, instance_id)
     if not found_instance:
         print_no_data(clusters)
         return 1
+    if fan_out:
+        return run_on_instances([found_instance], container_name, command, **fan_out)
     return ssh_instance(found_instance, container_name, command)
 
 
 def ssh_service_id(clusters, service_id, command, container_name, skip_prompts, include_active_instances,
-                   include_failed_instances, include_killed_instances):
+                   include_failed_instances, include_killed_instances, fan_out, query_result=None):
     instances = get_instances_from_service_id(clusters, service_id, include_active_instances, include_failed_instances,
-                                              include_killed_instances)
+                                              include_killed_instances, query_result)
     if instances is False:
         print_no_data(clusters)
         return 1
     if len(instances) == 0:
         print_no_instances(service_id)
         return 1
+    if fan_out:
+        return run_on_instances(instances, container_name, command, **fan_out)
     if skip_prompts:
         selected_instance = instances[0]
     else:
         column_names = ['Instance Id', 'Host', 'Status']
-        tabular_output = tabulate_service_instances(instances, show_index=True, column_names=column_names)
-        selected_instance = get_user_selection(instances, tabular_output)
+        columns = service_instance_columns(instances, show_index=True, column_names=column_names)
+        selected_instance = get_user_selection(instances, columns)
     return ssh_instance(selected_instance, container_name, command)
 
 
+def prefetch_services(executor, clusters_by_name, sorted_services):
+    """
+    Starts retrieving the top-ranked of the given services in the background, so that the selected one is likely
+    to be available by the time the user has chosen it; returns the futures keyed by (cluster name, service id)
+    """
+    return {(s['cluster'], s['service-id']): executor.submit(get_service_on_cluster, clusters_by_name[s['cluster']],
+                                                             s['service-id'])
+            for s in sorted_services[:PREFETCH_COUNT]}
+
+
+def get_prefetched_service(prefetches, cluster_name, service_id):
+    """
+    Returns the prefetched service as a query_service result, or None if the service was not prefetched
+    or its prefetch failed, in which case the caller queries the service again
+    """
+    future = prefetches.get((cluster_name, service_id))
+    if future is None:
+        logging.debug(f'service {service_id} on {cluster_name} was not prefetched')
+        return None
+    try:
+        service_data = future.result()
+    except Exception as e:
+        logging.exception(e)
+        logging.debug(f'unable to prefetch service {service_id} on {cluster_name}')
+        return None
+    return {'clusters': {cluster_name: service_data} if service_data['count'] > 0 else {},
+            'count': service_data['count']}
+
+
 def ssh_token(clusters, enforce_cluster, token, command, container_name, skip_prompts, include_active_instances,
-              include_failed_instances, include_killed_instances):
+              include_failed_instances, include_killed_instances, fan_out):
     if skip_prompts:
         cluster = get_target_cluster_from_token(clusters, token, enforce_cluster)
         query_result = get_services_on_cluster(cluster, token)
@@ -127,6 +297,7 @@ def ssh_token(clusters, enforce_cluster, token, command, container_name, skip_pr
             return 1
         max_last_request = max(s.get('last-request-time', '') for s in services)
         selected_service_id = next(s['service-id'] for s in services if s['last-request-time'] == max_last_request)
+        service_query_result = None
     else:
         query_result = query_token(clusters, token, include_services=True)
         if query_result['count'] == 0:
@@ -141,13 +312,22 @@ def ssh_token(clusters, enforce_cluster, token, command, container_name, skip_pr
             print_no_services(clusters, token)
             return 1
         column_names = ['Service Id', 'Cluster', 'Instances', 'In-flight req.', 'Status', 'Last request', 'Current?']
-        tabular_output, sorted_services = tabulate_token_services(services, token, show_index=True, summary_table=False,
-                                                                  column_names=column_names)
-        selected_service = get_user_selection(sorted_services, tabular_output)
-        selected_service_id = selected_service['service-id']
+        sorted_services = sort_token_services(services)
+        columns = token_service_columns(sorted_services, token, show_index=True, column_names=column_names)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=PREFETCH_COUNT)
+        try:
+            prefetches = prefetch_services(executor, clusters_by_name, sorted_services)
+            selected_service = get_user_selection(sorted_services, columns)
+            selected_service_id = selected_service['service-id']
+            service_query_result = get_prefetched_service(prefetches, selected_service['cluster'],
+                                                          selected_service_id)
+        finally:
+            # the other prefetches are no longer needed, and are not waited for
+            executor.shutdown(wait=False)
         clusters = [clusters_by_name[selected_service['cluster']]]
     return ssh_service_id(clusters, selected_service_id, command, container_name, skip_prompts,
-                          include_active_instances, include_failed_instances, include_killed_instances)
+                          include_active_instances, include_failed_instances, include_killed_instances, fan_out,
+                          service_query_result)
 
 
 def ssh(clusters, args, _, enforce_cluster):
@@ -160,14 +340,18 @@ def ssh(clusters, args, _, enforce_cluster):
     include_killed_instances = args.pop('include_killed_instances')
     container_name = args.pop('container_name', 'waiter-app')
     skip_prompts = args.pop('quick')
+    fan_out = None
+    if args.pop('all-instances', False):
+        fan_out = {'parallelism': args.pop('parallelism'), 'timeout_secs': args.pop('timeout')}
     if ssh_destination == Destination.TOKEN:
         return ssh_token(clusters, enforce_cluster, token_or_service_id_or_instance_id, command, container_name,
-                         skip_prompts, include_active_instances, include_failed_instances, include_killed_instances)
+                         skip_prompts, include_active_instances, include_failed_instances, include_killed_instances,
+                         fan_out)
     elif ssh_destination == Destination.SERVICE_ID:
         return ssh_service_id(clusters, token_or_service_id_or_instance_id, command, container_name, skip_prompts,
-                              include_active_instances, include_failed_instances, include_killed_instances)
+                              include_active_instances, include_failed_instances, include_killed_instances, fan_out)
     elif ssh_destination == Destination.INSTANCE_ID:
-        return ssh_instance_id(clusters, token_or_service_id_or_instance_id, command, container_name)
+        return ssh_instance_id(clusters, token_or_service_id_or_instance_id, command, container_name, fan_out)
 
 
 def register(add_parser):
@@ -206,5 +390,14 @@ def register(add_parser):
                               help="don't show failed instances in prompt")
     killed_group.add_argument('--no-killed', dest='include_killed_instances', action='store_false',
                               help="don't show killed instances in prompt")
+    parser.add_argument('--all-instances', '-A', dest='all-instances', action='store_true',
+                        help='run the command on all the included instances at once, rather than ssh to one of them; '
+                             'the output of each instance is prefixed with its id')
+    parser.add_argument('--parallelism', help='with --all-instances, the maximum number of instances on which the '
+                                              f'command runs concurrently (default is {DEFAULT_PARALLELISM})',
+                        type=check_positive, default=DEFAULT_PARALLELISM)
+    parser.add_argument('--timeout', help='with --all-instances, the number of seconds after which the command is '
+                                          f'killed on an instance (default is {DEFAULT_TIMEOUT_SECS} seconds)',
+                        type=check_positive, default=DEFAULT_TIMEOUT_SECS)
     parser.add_argument('command', nargs=argparse.REMAINDER, help='command to be run on instance')
     return ssh
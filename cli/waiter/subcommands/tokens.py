@@ -1,10 +1,10 @@
-import collections
 import getpass
+import shutil
+import sys
 
-from tabulate import tabulate
-
-from waiter.data_format import display_data
-from waiter.format import format_timestamp_string
+from waiter.data_format import display_query_result_stream
+from waiter.display import print_table
+from waiter.format import TimestampFormatter
 from waiter.querying import print_no_data, query_tokens
 from waiter.util import guard_no_cluster
 
@@ -16,17 +16,26 @@ def query_result_to_cluster_token_pairs(query_result):
     return cluster_token_pairs_sorted
 
 
+def cluster_tokens_to_records(cluster_name, entities):
+    """Returns one NDJSON record per token of the given cluster"""
+    return [{'cluster': cluster_name, **token} for token in entities.get('tokens', [])]
+
+
 def print_as_table(query_result):
     """Given a collection of (cluster, token) pairs, formats a table showing the most relevant token fields"""
     cluster_token_pairs = query_result_to_cluster_token_pairs(query_result)
-    rows = [collections.OrderedDict([("Cluster", cluster),
-                                     ("Owner", token['owner']),
-                                     ("Token", token['token']),
-                                     ("Maintenance", token.get('maintenance', False)),
-                                     ("Updated", format_timestamp_string(token['last-update-time']))])
-            for (cluster, token) in cluster_token_pairs]
-    token_table = tabulate(rows, headers='keys', tablefmt='plain')
-    print(token_table)
+    if not cluster_token_pairs:
+        print()
+        return
+    timestamp_formatter = TimestampFormatter()
+    columns = [('Cluster', [cluster for cluster, _ in cluster_token_pairs]),
+               ('Owner', [token['owner'] for _, token in cluster_token_pairs]),
+               ('Token', [token['token'] for _, token in cluster_token_pairs]),
+               ('Maintenance', [token.get('maintenance', False) for _, token in cluster_token_pairs]),
+               ('Updated', [timestamp_formatter.format(token['last-update-time']) for _, token in cluster_token_pairs])]
+    # on a terminal, lines are truncated rather than wrapped so that each token stays on a single line
+    max_width = shutil.get_terminal_size().columns if sys.stdout.isatty() else None
+    print_table(columns, max_width)
 
 
 def tokens(clusters, args, _, __):
@@ -34,19 +43,21 @@ def tokens(clusters, args, _, __):
     guard_no_cluster(clusters)
     as_json = args.get('json')
     as_yaml = args.get('yaml')
+    as_ndjson = args.get('ndjson')
     user = args.get('user')
 
-    query_result = query_tokens(clusters, user)
-    if as_json or as_yaml:
-        display_data(args, query_result)
-    else:
-        print_as_table(query_result)
+    if as_json or as_yaml or as_ndjson:
+        cluster_names = [c['name'] for c in clusters]
+        cluster_results = query_tokens(clusters, user, as_completed=True)
+        count = display_query_result_stream(args, cluster_names, cluster_results, cluster_tokens_to_records)
+        return 0 if count > 0 else 1
 
+    query_result = query_tokens(clusters, user)
+    print_as_table(query_result)
     if query_result['count'] > 0:
         return 0
     else:
-        if not as_json and not as_yaml:
-            print_no_data(clusters)
+        print_no_data(clusters)
         return 1
 
 
@@ -57,4 +68,6 @@ def register(add_parser):
     format_group = parser.add_mutually_exclusive_group()
     format_group.add_argument('--json', help='show the data in JSON format', dest='json', action='store_true')
     format_group.add_argument('--yaml', help='show the data in YAML format', dest='yaml', action='store_true')
+    format_group.add_argument('--ndjson', help='show the data as one JSON record per line, streamed per cluster',
+                              dest='ndjson', action='store_true')
     return tokens
@@ -7,7 +7,7 @@ import requests
 
 from waiter import terminal, http_util
 from waiter.data_format import determine_format, display_data, load_data
-from waiter.querying import get_token, query_token, get_target_cluster_from_token
+from waiter.querying import get_existing_token_from_snapshot, get_target_cluster_from_token, query_token_snapshot
 from waiter.util import deep_merge, FALSE_STRINGS, is_admin_enabled, print_info, response_message, TRUE_STRINGS, \
     guard_no_cluster, str2bool, update_in
 
@@ -70,12 +70,12 @@ def merge_token_fields_from_args(token_fields_base, token_fields_from_args):
     return token_fields
 
 
-def create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output):
+def create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output,
+                     existing_token_data, existing_token_etag):
     """Creates (or updates) the given token on the given cluster"""
     cluster_name = cluster['name']
     cluster_url = cluster['url']
 
-    existing_token_data, existing_token_etag = get_token(cluster, token_name)
     try:
         print_info(f'Attempting to {action} token {("in ADMIN mode " if admin_mode else "")}'
                    f'{("with dry-run enabled " if output else "")}on {terminal.bold(cluster_name)}...')
@@ -189,17 +189,23 @@ def create_or_update_token(clusters, args, _, enforce_cluster, action):
                             'one of your configured clusters.')
         elif num_default_create_clusters > 1:
             raise Exception('You have "default-for-create" set to true for more than one cluster.')
+
+    # A single snapshot provides the target cluster as well as the existing token data and etag used for the post
+    query_result = query_token_snapshot(clusters, token_name)
+    if len(clusters) > 1:
+        token_exists = any(not data['token'].get('deleted', False) for data in query_result['clusters'].values())
+        cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster, query_result) \
+            if token_exists else None
+        if cluster:
+            logging.debug(f'token already exists in: {cluster}')
         else:
-            query_result = query_token(clusters, token_name)
-            if query_result['count'] > 0:
-                cluster = get_target_cluster_from_token(clusters, token_name, enforce_cluster)
-                logging.debug(f'token already exists in: {cluster}')
-            else:
-                cluster = default_for_create[0]
+            cluster = default_for_create[0]
     else:
         cluster = clusters[0]
 
-    return create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output)
+    existing_token_data, existing_token_etag = get_existing_token_from_snapshot(query_result, cluster)
+    return create_or_update(cluster, token_name, token_fields, admin_mode, action, fields_from_args_only, output,
+                            existing_token_data, existing_token_etag)
 
 
 def add_arguments(parser):
@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import sys
+import tempfile
 import time
 from datetime import datetime, timedelta
 
@@ -138,6 +139,39 @@ def load_json_file(path):
     return content
 
 
+def cache_file_path(file_name):
+    """
+    Returns the path of the given file in the CLI's cache directory, $XDG_CACHE_HOME/waiter
+    (~/.cache/waiter by default), creating the directory if needed
+    """
+    cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'waiter')
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, file_name)
+
+
+def write_file_atomically(path, write_content):
+    """
+    Calls write_content with a temporary file, which then replaces the file at the given path; the temporary file
+    is unique, so that concurrent writers (e.g. the threads of batch or the agent) never write to the same one
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            write_content(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_file_atomically(path, content):
+    """Writes the content as JSON to a temporary file, which then replaces the file at the given path"""
+    write_file_atomically(path, lambda json_file: json.dump(content, json_file))
+
+
 def is_service_current(service, current_token_etag, token_name):
     """Returns True if any of the given service's source tokens is the current token"""
     is_current = any(source['version'] == current_token_etag and source['token'] == token_name
@@ -149,3 +183,8 @@ def is_service_current(service, current_token_etag, token_name):
 def is_admin_enabled():
     """Returns True if current user is an admin"""
     return str2bool(os.getenv('WAITER_ADMIN', default=FALSE_STRINGS[0]))
+
+
+def is_agent_enabled():
+    """Returns True if commands should be forwarded to the local agent"""
+    return str2bool(os.getenv('WAITER_AGENT', default=FALSE_STRINGS[0]))
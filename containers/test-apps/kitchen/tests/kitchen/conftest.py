@@ -21,7 +21,7 @@ def _find_free_port(hostname, start_port=8000, attempts=1000):
 
 
 class KitchenServer():
-    def __init__(self, ssl=False):
+    def __init__(self, ssl=False, server_mode='threaded', workers=1):
         self.scheme = 'https' if ssl else 'http'
         self.kitchen_path = os.getenv('KITCHEN_PATH', './bin/kitchen')
         self.hostname = os.getenv('KITCHEN_HOSTNAME', 'localhost')
@@ -29,7 +29,8 @@ class KitchenServer():
         self.port = int(port_string) if port_string else _find_free_port(self.hostname)
         if os.getenv('KITCHEN_AUTOSTART', 'true').lower() == 'true':
             logging.info(f'Automatically starting new Kitchen server')
-            args = [self.kitchen_path, '--hostname', self.hostname, '--port', str(self.port)]
+            args = [self.kitchen_path, '--hostname', self.hostname, '--port', str(self.port),
+                    '--server-mode', server_mode, '--workers', str(workers)]
             if ssl:
                 args.append('--ssl')
             self.__server_process = subprocess.Popen(args)
@@ -53,16 +54,23 @@ class KitchenServer():
             self.__server_process.terminate()
             logging.info(f'Kitchen server has been killed')
 
-@pytest.fixture(scope="session")
+@pytest.fixture(scope="session", params=['threaded', 'asyncio'])
 def kitchen_server(request):
-    """Manages an instance of the Kitchen test app server."""
-    server = KitchenServer()
+    """Manages an instance of the Kitchen test app server, in each server mode."""
+    server = KitchenServer(server_mode=request.param)
     request.addfinalizer(server.kill)
     return server
 
 @pytest.fixture(scope="session")
+def kitchen_workers_server(request):
+    """Manages an instance of the Kitchen test app server with multiple worker processes."""
+    server = KitchenServer(workers=4)
+    request.addfinalizer(server.kill)
+    return server
+
+@pytest.fixture(scope="session", params=['threaded', 'asyncio'])
 def kitchen_ssl_server(request):
-    """Manages an instance of the Kitchen test app server with SSL."""
-    server = KitchenServer(ssl=True)
+    """Manages an instance of the Kitchen test app server with SSL, in each server mode."""
+    server = KitchenServer(ssl=True, server_mode=request.param)
     request.addfinalizer(server.kill)
     return server
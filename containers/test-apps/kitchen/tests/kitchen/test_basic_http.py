@@ -3,6 +3,7 @@ import itertools
 import logging
 import pytest
 import requests
+import string
 import tenacity
 import threading
 import time
@@ -142,6 +143,34 @@ class TestBasicHttp:
         assert len(req.content) == n
         assert req.text == lorem_ipsum(n)
 
+    def test_unchunked_encoding(self, kitchen_server):
+        """Test for exact payload contents of large unchunked responses"""
+        n = 3 * 1024 * 1024 + 7
+        req = requests.get(kitchen_server.url('/unchunked'), headers={'x-kitchen-response-size': str(n)})
+        assert req.status_code == requests.codes.ok
+        assert req.headers.get('Content-Length') == str(n)
+        assert req.text == lorem_ipsum(n)
+
+    def test_chunked_encoding_large_chunks(self, kitchen_server):
+        """Test for valid chunked encoding of response payloads with chunks larger than the write blocks"""
+        n = 5 * 1024 * 1024
+        req = requests.get(kitchen_server.url('/chunked'),
+                           headers={'x-kitchen-chunk-size': str(2 * 1024 * 1024 + 3), 'x-kitchen-response-size': str(n)})
+        assert req.status_code == requests.codes.ok
+        assert req.headers.get('Transfer-Encoding') == 'chunked'
+        assert req.text == lorem_ipsum(n)
+
+    def test_fail_after(self, kitchen_server):
+        """Test that a response is cut off after exactly the requested number of bytes"""
+        n = 5000
+        req = requests.get(kitchen_server.url('/unchunked'),
+                           headers={'x-kitchen-fail-after': str(n), 'x-kitchen-response-size': str(2 * n)},
+                           stream=True)
+        assert req.headers.get('Content-Length') == str(2 * n)
+        assert req.raw.read(n) == lorem_ipsum(n).encode('ascii')
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            req.content
+
     def test_gzip_encoding(self, kitchen_server):
         """Test for valid gzip encoding of response payloads"""
         n = 1024 * 1024
@@ -151,3 +180,88 @@ class TestBasicHttp:
         assert req.headers.get('Content-Encoding') == 'gzip'
         assert len(req.content) == n
         assert req.text == lorem_ipsum(n)
+
+    def test_websocket_random_payloads(self, kitchen_server):
+        """Test for random binary and text WebSocket payloads of the requested sizes"""
+        ws = util.WebSocketClient(kitchen_server.hostname, kitchen_server.port, '/ws-test')
+        try:
+            assert ws.receive() == (0x1, b'Connected to kitchen')
+            n = 10 * 1024 * 1024
+            ws.send_text(f'bytes-{n}')
+            opcode, payload = ws.receive()
+            assert opcode == 0x2
+            assert len(payload) == n
+            assert max(payload) < 128
+            ws.send_text(f'chars-{n}')
+            opcode, payload = ws.receive()
+            assert opcode == 0x1
+            assert len(payload) == n
+            assert set(payload) == set(string.ascii_uppercase.encode('ascii'))
+        finally:
+            ws.close()
+
+    def test_gzip_encoding_chunked(self, kitchen_server):
+        """Test for valid gzip encoding of chunked response payloads, compressed as they are sent"""
+        n = 1024 * 1024
+        for _ in range(2):  # the second response is served from the cache
+            req = requests.get(kitchen_server.url('/gzip'),
+                               headers={'x-kitchen-chunk-size': '1000', 'x-kitchen-compression-level': '1',
+                                        'x-kitchen-response-size': str(n)})
+            assert req.status_code == requests.codes.ok
+            assert req.headers.get('Content-Encoding') == 'gzip'
+            assert req.headers.get('Transfer-Encoding') == 'chunked'
+            assert req.text == lorem_ipsum(n)
+
+    def test_compression_negotiation(self, kitchen_server):
+        """Test that the /gzip endpoint honors the Accept-Encoding header"""
+        n = 1024 * 1024
+        for accept_encoding, content_encoding in [('deflate', 'deflate'),
+                                                  ('gzip;q=0.5, deflate', 'deflate'),
+                                                  ('*', 'gzip'),
+                                                  ('identity', None)]:
+            req = requests.get(kitchen_server.url('/gzip'),
+                               headers={'Accept-Encoding': accept_encoding, 'x-kitchen-response-size': str(n)})
+            assert req.status_code == requests.codes.ok
+            assert req.headers.get('Content-Encoding') == content_encoding, accept_encoding
+            assert req.headers.get('Vary') == 'Accept-Encoding'
+            assert req.text == lorem_ipsum(n)
+
+    def test_header_line_too_long(self, kitchen_server):
+        """Test that a header line longer than the limit is rejected, rather than the connection dropped"""
+        req = requests.get(kitchen_server.url(), headers={'x-padding': 'a' * 70000})
+        assert req.status_code == 431
+        assert req.reason == 'Line too long'
+        req = requests.get(kitchen_server.url())
+        assert req.status_code == requests.codes.ok
+
+    def test_workers(self, kitchen_workers_server):
+        """Test that worker processes share the request counters, and die individually"""
+        def kitchen_state():
+            req = requests.get(kitchen_workers_server.url('/kitchen-state'))
+            assert req.status_code == requests.codes.ok
+            return req.json()
+
+        def total_http_requests():
+            return kitchen_state().get('total-http-requests')
+
+        initial_total = total_http_requests()
+        for _ in range(20):
+            assert requests.get(kitchen_workers_server.url()).status_code == requests.codes.ok
+        # each request opens a new connection, so the requests are spread across the workers
+        assert total_http_requests() == initial_total + 21
+
+        with pytest.raises(requests.exceptions.ConnectionError):
+            requests.get(kitchen_workers_server.url('/die'))
+
+        @tenacity.retry(stop=tenacity.stop_after_delay(10), wait=tenacity.wait_fixed(0.1))
+        def await_response():
+            assert requests.get(kitchen_workers_server.url()).status_code == requests.codes.ok
+        # the remaining workers keep serving
+        for _ in range(20):
+            await_response()
+
+        @tenacity.retry(stop=tenacity.stop_after_delay(10), wait=tenacity.wait_fixed(0.1))
+        def await_no_pending_requests():
+            assert kitchen_state().get('pending-http-requests') == 0
+        # the /die request never completed, it is no longer pending once its worker has been reaped
+        await_no_pending_requests()
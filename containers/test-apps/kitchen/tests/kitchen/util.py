@@ -1,3 +1,50 @@
+import base64
+import os
+import socket
+import struct
+
 # default time limit for each individual integration test
 # if a test takes more than 10 minutes, it's probably broken
 DEFAULT_TEST_TIMEOUT_SECS = 600
+
+
+class WebSocketClient():
+    """A minimal blocking WebSocket client, enough to exchange unfragmented messages with kitchen."""
+
+    def __init__(self, hostname, port, path='/'):
+        self.__sock = socket.create_connection((hostname, port))
+        self.__rfile = self.__sock.makefile('rb')
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.__sock.sendall((f'GET {path} HTTP/1.1\r\n'
+                             f'Host: {hostname}:{port}\r\n'
+                             'Upgrade: websocket\r\n'
+                             'Connection: Upgrade\r\n'
+                             f'Sec-WebSocket-Key: {key}\r\n'
+                             'Sec-WebSocket-Version: 13\r\n'
+                             '\r\n').encode('ascii'))
+        status_line = self.__rfile.readline()
+        assert b' 101 ' in status_line, status_line
+        while self.__rfile.readline() not in (b'\r\n', b''):
+            pass
+
+    def send_text(self, text):
+        """Send a masked text frame."""
+        payload = text.encode('utf-8')
+        assert len(payload) <= 125
+        mask = os.urandom(4)
+        masked_payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.__sock.sendall(bytes([0x81, 0x80 | len(payload)]) + mask + masked_payload)
+
+    def receive(self):
+        """Return the (opcode, payload) of the next frame."""
+        first_byte, length = struct.unpack('>BB', self.__rfile.read(2))
+        length &= 0x7f
+        if length == 126:
+            length = struct.unpack('>H', self.__rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self.__rfile.read(8))[0]
+        return first_byte & 0x0f, self.__rfile.read(length)
+
+    def close(self):
+        self.__rfile.close()
+        self.__sock.close()